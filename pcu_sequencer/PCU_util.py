@@ -1,39 +1,53 @@
-import yaml
-import sys
+import os
+import time
+
+from configs import ConfigStore, ConfigError
 
 motor_file = "./motor_configurations.yaml"
 config_file = "./PCU_configurations.yaml"
 
+# Shared store, files are only re-read when they change
+store = ConfigStore(config_file, motor_file)
+
 def load_configurations():
-    # Load configuration files
-    try:
-        # Open and read config file with info on named positions
-        with open(config_file) as f:
-            file = f.read()
-            configurations = list(yaml.load_all(file))
-            # Return all config files
-            return configurations
-            # FIX-YAML version on k1aoserver-new is too old.
-    except:
-        print("Unable to read configuration file. Shutting down.")
-        sys.exit(1)
+    """ Returns the base, fiber and mask configurations (raises ConfigError) """
+    compiled = store.load()
+    return [compiled.base_configs, compiled.fiber_configs, compiled.mask_configs]
 
 def load_motors():
-    # Open and read motor file with info on valid motors
-    try:
-        with open(motor_file) as f: # FIX Z-STAGE
-            file = f.read()
-            motor_info = yaml.load(file)
-            return motor_info
-    except:
-        print("Unable to read motor file. Shutting down.")
-        sys.exit(1)
-
-# Load configuration files into variables
-base_configs, fiber_configs, mask_configs = load_configurations()
-motor_info = load_motors()
-# Assign motor info to variables
-valid_motors = motor_info['valid_motors']
-tolerance = motor_info['tolerance']
-fiber_limits = motor_info['fiber_limits']
-mask_limits = motor_info['mask_limits']
\ No newline at end of file
+    """ Returns the motor info dictionary (raises ConfigError) """
+    return store.load().motor_info
+
+# Module variables, loaded from the files on first use (see __getattr__)
+_CONFIG_VARS = {
+    'base_configs': lambda c: c.base_configs,
+    'fiber_configs': lambda c: c.fiber_configs,
+    'mask_configs': lambda c: c.mask_configs,
+    'motor_info': lambda c: c.motor_info,
+    'valid_motors': lambda c: c.motor_info['valid_motors'],
+    'tolerance': lambda c: c.motor_info['tolerance'],
+    'fiber_limits': lambda c: c.motor_info['fiber_limits'],
+    'mask_limits': lambda c: c.motor_info['mask_limits'],
+}
+
+def keep_previous(path):
+    """ 
+    Renames an existing file at path with its modification time
+    (e.g. k1.tlm to k1-20261017-031500.tlm), so a restart never overwrites
+    it. Returns the new name, or None if there was no file.
+    """
+    if not os.path.exists(path):
+        return None
+    root, ext = os.path.splitext(path)
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(os.path.getmtime(path)))
+    new_path, n = f"{root}-{stamp}{ext}", 1
+    while os.path.exists(new_path):
+        new_path, n = f"{root}-{stamp}-{n}{ext}", n+1
+    os.replace(path, new_path)
+    return new_path
+
+def __getattr__(name):
+    """ Loads configuration variables when they are first used, not at import """
+    if name not in _CONFIG_VARS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _CONFIG_VARS[name](store.load())
@@ -0,0 +1,234 @@
+### benchmark.py : Benchmarks of the PCU sequencer, run against simulated motors
+### Date : 10/17/26
+
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import PCU_util as util
+from configs import ConfigMatcher
+from geometry import PCUGeometry
+from positions import PCUPos, PCUPosArray
+from sequencer import PCUStates
+from virtual import VirtualDriver
+
+# Handlers timed per tick
+STATES = ['INPOS', 'MOVING']
+# Statistics compared between runs
+COMPARED = ['mean', 'p50']
+
+def summarize(samples):
+    """ Returns summary statistics (dict) of a list of samples """
+    samples = np.asarray(samples, dtype=float)
+    if len(samples) == 0:
+        return {'n': 0}
+    return {
+        'n': len(samples),
+        'mean': float(samples.mean()),
+        'p50': float(np.percentile(samples, 50)),
+        'p99': float(np.percentile(samples, 99)),
+        'max': float(samples.max()),
+    }
+
+def timed(fn, repeat):
+    """ Returns summary statistics of the wall time (s) of repeat calls to fn """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+def ca_calls(seq):
+    """ Returns the number of motor channel operations made by the sequencer's motors """
+    return sum(motor.ca_calls.value for motor in seq.motors.values())
+
+def bench_ticks(driver, names, idle=5):
+    """
+    Runs every named configuration in turn, one tick per tick period, and
+    returns the CPU time (s) and motor channel operations of each tick by state
+    """
+    seq = driver.sequencer
+    samples = {state: {'cpu_time': [], 'ca_calls': []} for state in STATES}
+
+    # Wrap the state handlers called by the driver
+    for state in STATES:
+        handler = getattr(seq, f"process_{state}")
+        def wrapper(handler=handler, state=state):
+            calls = ca_calls(seq)
+            start = time.process_time()
+            handler()
+            samples[state]['cpu_time'].append(time.process_time() - start)
+            samples[state]['ca_calls'].append(ca_calls(seq) - calls)
+        setattr(seq, f"process_{state}", wrapper)
+
+    skip, driver.skip = driver.skip, False
+    try:
+        for name in names[1:] + names[:1]:
+            driver.move_to(name)
+            driver.run(idle)
+    finally:
+        driver.skip = skip
+        for state in STATES:
+            delattr(seq, f"process_{state}")
+
+    return {state: {key: summarize(vals) for key, vals in samples[state].items()}
+            for state in STATES}
+
+def bench_reconfigurations(driver, names):
+    """ Returns the virtual and wall time of a reconfiguration between every pair of configurations """
+    results = []
+    for start, end in itertools.permutations(names, 2):
+        if driver.move_to(start) != PCUStates.INPOS:
+            driver.sequencer.to_INIT()
+            continue
+        ticks, virtual, wall = driver.ticks, driver.clock.time(), time.perf_counter()
+        state = driver.move_to(end)
+        results.append({
+            'from': start,
+            'to': end,
+            'state': state.name,
+            'virtual_time': driver.clock.time() - virtual,
+            'wall_time': time.perf_counter() - wall,
+            'ticks': driver.ticks - ticks,
+        })
+    return {
+        'pairs': results,
+        'virtual_time': summarize([r['virtual_time'] for r in results]),
+        'wall_time': summarize([r['wall_time'] for r in results]),
+    }
+
+def bench_configs(driver, sizes, repeat, seed=0):
+    """ Returns the cost of get_config and user_configs_valid for growing numbers of configurations """
+    seq = driver.sequencer
+    rng = np.random.default_rng(seed)
+    base = list(seq.user_configs.values())
+    matcher, user_configs = seq.matcher, seq.user_configs
+
+    results = {}
+    try:
+        for n in sizes:
+            # Copies of the user configurations, offset within tolerance
+            configs = {f"config{i}": {m_name: base[i % len(base)][m_name] +
+                                      rng.uniform(-0.5, 0.5)*seq.tolerance[m_name]
+                                      for m_name in seq.valid_motors}
+                       for i in range(n)}
+            seq.matcher = ConfigMatcher.from_configs(configs, seq.valid_motors, seq.tolerance)
+            seq.user_configs = configs
+            results[str(n)] = {
+                'get_config': timed(seq.get_config, repeat),
+                'user_configs_valid': timed(seq.user_configs_valid, repeat),
+            }
+    finally:
+        seq.matcher, seq.user_configs = matcher, user_configs
+
+    return results
+
+def bench_positions(n, repeat, seed=0):
+    """ Returns the throughput (positions/s) of PCUPos construction and validation """
+    rng = np.random.default_rng(seed)
+    geometry = PCUGeometry.from_compiled(util.store.load(), PCUPos.valid_motors)
+    dicts = [dict(zip(PCUPos.valid_motors, row))
+             for row in rng.uniform(0, 200, size=(n, len(PCUPos.valid_motors)))]
+    positions = [PCUPos(d, geometry=geometry) for d in dicts]
+
+    def construct():
+        for d in dicts: PCUPos(d, geometry=geometry)
+    def validate():
+        for pos in positions: pos.is_valid()
+    def validate_array():
+        PCUPosArray.from_dicts(dicts, geometry=geometry).is_valid()
+
+    results = {}
+    for key, fn in [('construct', construct), ('is_valid', validate), ('array_is_valid', validate_array)]:
+        stats = timed(fn, repeat)
+        stats['rate'] = n / stats['p50']
+        results[key] = stats
+    return results
+
+def git_version():
+    """ Returns the current git commit, or None outside a repository """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(results, path=()):
+    """ Yields (path, value) for every compared statistic in a results dictionary """
+    if isinstance(results, dict):
+        for key, val in results.items():
+            if key in COMPARED and isinstance(val, (int, float)):
+                yield path + (key,), val
+            else:
+                yield from flatten(val, path + (key,))
+    elif isinstance(results, list):
+        for i, val in enumerate(results):
+            yield from flatten(val, path + (str(i),))
+
+def compare(old, new, threshold):
+    """ Returns a list of (path, old, new) for statistics that got slower by more than threshold """
+    old_vals = dict(flatten(old['results']))
+    slower = []
+    for path, val in flatten(new['results']):
+        if path in old_vals and old_vals[path] > 0 and val > old_vals[path]*(1 + threshold):
+            slower.append(('/'.join(path), old_vals[path], val))
+    return slower
+
+# -------------------------------------------------------------------------
+# Main function
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the PCU sequencer against simulated motors.")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file for the results")
+    parser.add_argument("--repeat", type=int, default=100, help="Repeats of each timed call")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[10, 100, 1000, 10000],
+                        help="Numbers of configurations for get_config and user_configs_valid")
+    parser.add_argument("--positions", type=int, default=1000, help="Positions per throughput run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", help="Earlier results (JSON) to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Fractional slowdown reported as a regression")
+    args = parser.parse_args()
+
+    # One sequencer, with simulated motors in place of the IOC
+    driver = VirtualDriver.create(seed=args.seed)
+    driver.run_until(lambda: driver.state != PCUStates.INIT, 10)
+    names = list(driver.sequencer.all_configs)
+
+    results = {
+        'meta': {
+            'commit': git_version(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'results': {
+            'ticks': bench_ticks(driver, names),
+            'reconfigurations': bench_reconfigurations(driver, names),
+            'configs': bench_configs(driver, args.sizes, args.repeat, seed=args.seed),
+            'positions': bench_positions(args.positions, max(1, args.repeat//10), seed=args.seed),
+        },
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}.")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        slower = compare(old, results, args.threshold)
+        for path, old_val, new_val in slower:
+            print(f"Slower: {path}: {old_val:.3g} -> {new_val:.3g}")
+        if len(slower) != 0:
+            sys.exit(1)
@@ -0,0 +1,43 @@
+# Marker for a channel that has not been written yet
+_UNSET = object()
+
+# Write-on-change channel class
+class ChangedChannel():
+    """
+    Wraps an IOC channel so that set() only posts values that changed
+    (beyond a deadband, for numbers). Only for channels that are written
+    by the sequencer alone, since client writes bypass the cached value.
+    """
+
+    def __init__(self, channel, deadband=0):
+        self.channel = channel
+        self.deadband = deadband
+        self._last = _UNSET
+
+    def __getattr__(self, name):
+        # Everything else goes to the wrapped channel
+        return getattr(self.channel, name)
+
+    def changed(self, val):
+        """ Checks whether val differs from the last posted value """
+        last = self._last
+        if last is _UNSET:
+            return True
+        # Numbers within the deadband count as unchanged
+        if isinstance(val, (int, float)) and isinstance(last, (int, float)):
+            return abs(val - last) > self.deadband
+        return val != last
+
+    def get(self):
+        return self.channel.get()
+
+    def set(self, val):
+        """ Posts val only if it has changed """
+        if not self.changed(val):
+            return
+        self.channel.set(val)
+        self._last = val
+
+    def reset(self):
+        """ Forces the next set() to post """
+        self._last = _UNSET
@@ -0,0 +1,59 @@
+import time
+
+# Wall clock class
+class WallClock():
+    """ Real time, as used on the telescope """
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+# Virtual clock class
+class VirtualClock():
+    """
+    Simulated time, which only moves when advanced. Lets the sequencer
+    and simulated motors run faster than real time, deterministically.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = float(start)
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        """ Moves the clock forward by seconds """
+        if seconds < 0:
+            raise ValueError(f"Cannot move the clock backwards ({seconds} s).")
+        self.now += seconds
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+# Countdown timer class
+class ClockTimer():
+    """ Countdown timer on a clock (same interface as CountdownTimer) """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.end = None
+
+    def start(self, seconds=0):
+        """ Starts counting down from now """
+        self.end = self.clock.time() + seconds
+
+    def stop(self):
+        self.end = None
+
+    @property
+    def expired(self):
+        return self.end is not None and self.clock.time() >= self.end
+
+    @property
+    def remaining(self):
+        """ Time left (s), or None if not started """
+        if self.end is None:
+            return None
+        return max(0, self.end - self.clock.time())
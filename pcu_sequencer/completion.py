@@ -0,0 +1,57 @@
+import threading
+
+from epics import ca
+
+# Completion engine class
+class CompletionEngine():
+    """
+    Advances the sequencer's move queue as soon as the current move settles.
+
+    Motor monitors only wake the engine; queued moves are triggered from its
+    own thread, since CA calls are not safe inside CA callbacks.
+    """
+
+    # Longest wait between checks if no monitor fires (seconds)
+    max_wait = 1.0
+
+    def __init__(self, sequencer):
+        self.sequencer = sequencer
+        self._event = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def notify(self, motor=None):
+        """ Motor listener, wakes the engine thread """
+        self._event.set()
+
+    def start(self):
+        """ Subscribes to the sequencer's motors and starts the engine thread """
+        if self._running:
+            return
+        for motor in self.sequencer.motors.values():
+            motor.add_listener(self.notify)
+
+        self._running = True
+        self._thread = threading.Thread(target=self.run, name="PCUCompletion", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stops the engine thread (safe to call if it never started) """
+        self._running = False
+        self._event.set()
+
+    def run(self):
+        # Share the CA context of the thread that created the motors
+        ca.use_initial_context()
+        while self._running:
+            self._event.wait(self.max_wait)
+            self._event.clear()
+            if not self._running:
+                break
+            # The sequencer state is only read between ticks
+            with self.sequencer.move_lock:
+                try:
+                    self.sequencer.advance_moves()
+                except Exception as err:
+                    # The tick loop handles faults; just report here
+                    self.sequencer.critical(f"Move completion error: {err}")
@@ -0,0 +1,194 @@
+import hashlib
+import os
+
+import numpy as np
+import yaml
+
+# Use the C YAML loader when it is available
+YAMLLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Sections of the configuration and motor files
+CONFIG_SECTIONS = ['base', 'fiber', 'mask']
+MOTOR_KEYS = ['valid_motors', 'limits', 'tolerance', 'fiber_limits', 'mask_limits']
+
+class ConfigError(Exception):
+    """ Raised for configuration files that are missing or invalid """
+    pass
+
+# Configuration matcher class
+class ConfigMatcher():
+    """
+    Holds all named configurations as one matrix (configs x motors) and
+    finds the configuration nearest to a set of motor positions.
+    """
+
+    def __init__(self, names, motors, matrix, tolerance):
+        """ Initializes from config names, motor names, a position matrix and tolerances (dict) """
+        self.names = list(names)
+        self.motors = list(motors)
+        self.matrix = np.asarray(matrix, dtype=float).reshape(len(self.names), len(self.motors))
+        self.tolerance = np.array([tolerance[m] for m in self.motors], dtype=float)
+
+    @classmethod
+    def from_configs(cls, configs, motors, tolerance):
+        """ Initializes from a dictionary of configurations """
+        matrix = [[configs[c][m] for m in motors] for c in configs]
+        return cls(configs, motors, matrix, tolerance)
+
+    @classmethod
+    def from_compiled(cls, compiled, motors, tolerance):
+        """ Initializes from the position matrix of a CompiledConfigs """
+        columns = [compiled.motor_index[m] for m in motors]
+        return cls(compiled.names, motors, compiled.matrix[:, columns], tolerance)
+
+    def distances(self, positions):
+        """
+        Returns the distance of positions (dict) to every configuration,
+        as the largest per-motor offset in units of that motor's tolerance
+        """
+        pos = np.array([positions[m] for m in self.motors], dtype=float)
+        return (np.abs(pos - self.matrix) / self.tolerance).max(axis=1, initial=0)
+
+    def match(self, positions):
+        """
+        Returns the nearest configuration name, or None if no configuration
+        is within tolerance (offsets from it are published by the sequencer)
+        """
+        if len(self.names) == 0:
+            return None
+
+        dist = self.distances(positions)
+        # First configuration in file order wins a tie
+        idx = int(np.argmin(dist))
+        return self.names[idx] if dist[idx] < 1 else None
+
+# Compiled configuration class
+class CompiledConfigs():
+    """
+    Validated contents of the configuration and motor files, with all
+    named positions compiled to a matrix (configs x motors) and the
+    motor limits to arrays.
+    """
+
+    def __init__(self, configurations, motor_info):
+        """ Validates the parsed YAML files, raising ConfigError if invalid """
+        self.motor_info = self.check_motor_info(motor_info)
+        self.base_configs, self.fiber_configs, self.mask_configs = \
+            self.check_configurations(configurations, motor_info['valid_motors'])
+
+        # Assign motor info to variables
+        self.valid_motors = motor_info['valid_motors']
+        self.limits = motor_info['limits']
+        self.tolerance = motor_info['tolerance']
+        self.fiber_limits = motor_info['fiber_limits']
+        self.mask_limits = motor_info['mask_limits']
+
+        # Name index and position matrix of all configurations
+        self.all_configs = dict(self.base_configs, **self.fiber_configs, **self.mask_configs)
+        self.user_configs = dict(self.fiber_configs, **self.mask_configs)
+        self.names = list(self.all_configs)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.motors = list(self.limits)
+        self.motor_index = {m_name: i for i, m_name in enumerate(self.motors)}
+        self.matrix = np.array([[config.get(m_name, 0) for m_name in self.motors]
+                                for config in self.all_configs.values()],
+                               dtype=float).reshape(len(self.names), len(self.motors))
+        # Lower and upper limits of each motor
+        self.lower = np.array([self.limits[m][0] for m in self.motors], dtype=float)
+        self.upper = np.array([self.limits[m][1] for m in self.motors], dtype=float)
+
+    @staticmethod
+    def check_motor_info(motor_info):
+        """ Checks the contents of the motor file """
+        if not isinstance(motor_info, dict):
+            raise ConfigError("Motor file must contain a single mapping.")
+        for key in MOTOR_KEYS:
+            if key not in motor_info:
+                raise ConfigError(f"Motor file is missing '{key}'.")
+
+        for key in ['limits', 'fiber_limits', 'mask_limits']:
+            for m_name, lims in motor_info[key].items():
+                if (not isinstance(lims, list) or len(lims) != 2 or lims[0] > lims[1]):
+                    raise ConfigError(f"Invalid {key} for {m_name}: {lims}")
+        for m_name in motor_info['valid_motors']:
+            if m_name not in motor_info['limits']:
+                raise ConfigError(f"No limits for valid motor {m_name}.")
+            if not motor_info['tolerance'].get(m_name, 0) > 0:
+                raise ConfigError(f"No positive tolerance for valid motor {m_name}.")
+        return motor_info
+
+    @staticmethod
+    def check_configurations(configurations, valid_motors):
+        """ Checks the named positions in the configuration file """
+        if len(configurations) != len(CONFIG_SECTIONS):
+            raise ConfigError(f"Configuration file must have {len(CONFIG_SECTIONS)} " +
+                              f"sections, found {len(configurations)}.")
+
+        names = set()
+        for section, configs in zip(CONFIG_SECTIONS, configurations):
+            if not isinstance(configs, dict):
+                raise ConfigError(f"Section '{section}' must be a mapping of named positions.")
+            for c_name, pos in configs.items():
+                if c_name in names:
+                    raise ConfigError(f"Configuration {c_name} is defined twice.")
+                names.add(c_name)
+                if not isinstance(pos, dict):
+                    raise ConfigError(f"Configuration {c_name} must be a mapping of motors.")
+                for m_name in valid_motors:
+                    if not isinstance(pos.get(m_name), (int, float)):
+                        raise ConfigError(f"Configuration {c_name} has no position for {m_name}.")
+        return configurations
+
+# Configuration store class
+class ConfigStore():
+    """
+    Loads and compiles the configuration files. Unchanged files are not
+    re-read, and touched files with unchanged contents are not recompiled.
+    """
+
+    def __init__(self, config_file, motor_file):
+        self.files = [config_file, motor_file]
+        self.compiled = None
+        self._stats = None
+
+    def stat(self):
+        """ Returns modification times and sizes of the files """
+        try:
+            return tuple((st.st_mtime_ns, st.st_size) for st in map(os.stat, self.files))
+        except OSError as err:
+            raise ConfigError(f"Unable to read configuration files: {err}")
+
+    def load(self):
+        """ Returns the CompiledConfigs, re-reading the files only if they changed """
+        stats = self.stat()
+        if self.compiled is not None and stats == self._stats:
+            return self.compiled
+
+        try:
+            data = []
+            for file in self.files:
+                with open(file, 'rb') as f:
+                    data.append(f.read())
+        except OSError as err:
+            raise ConfigError(f"Unable to read configuration files: {err}")
+
+        # Touched but unchanged files give the same compiled object
+        digest = hashlib.sha1(b'\0'.join(data)).hexdigest()
+        if self.compiled is not None and digest == self.compiled.digest:
+            self._stats = stats
+            return self.compiled
+
+        compiled = self.compile(*data)
+        compiled.digest = digest
+
+        self.compiled, self._stats = compiled, stats
+        return compiled
+
+    def compile(self, config_data, motor_data):
+        """ Parses and validates the YAML files """
+        try:
+            configurations = list(yaml.load_all(config_data, Loader=YAMLLoader))
+            motor_info = yaml.load(motor_data, Loader=YAMLLoader)
+        except yaml.YAMLError as err:
+            raise ConfigError(f"Unable to parse configuration files: {err}")
+        return CompiledConfigs(configurations, motor_info)
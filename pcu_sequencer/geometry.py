@@ -0,0 +1,130 @@
+import numpy as np
+
+# Default clearance around each element's center (mm)
+CLEARANCE_PMASK = 35 # mm, including mask radius
+CLEARANCE_FIBER = 35 # mm, including fiber radius
+
+# Geometry class
+class PCUGeometry():
+    """
+    Compiled collision model of the PCU. An element ('mask' or 'fiber') may
+    only be extended (Z > 0) when X and Y are inside both its keep-in
+    rectangle and its clearance circle in the K-mirror rotator. All motors
+    must be within their limits. Checks take an (N x motors) array and
+    answer for all N positions at once.
+    """
+
+    # Z motor of each element
+    z_motors = {'mask': 'm3', 'fiber': 'm4'}
+
+    def __init__(self, motors, limits, keep_in, centers, radii):
+        """
+        Initializes from motor names (column order), per-axis limits (dict),
+        and per-element keep-in rectangles (dicts of XY limits), circle
+        centers (x, y) and radii
+        """
+        self.motors = list(motors)
+        idx = {m_name: i for i, m_name in enumerate(self.motors)}
+        self.x, self.y = idx['m1'], idx['m2']
+
+        # Per-axis limits, unlimited if not given
+        self.lower = np.array([limits[m][0] if m in limits else -np.inf for m in self.motors])
+        self.upper = np.array([limits[m][1] if m in limits else np.inf for m in self.motors])
+
+        # One row per element
+        self.elements = list(keep_in)
+        self.z = np.array([idx[self.z_motors[e]] for e in self.elements])
+        self.rect_lower = np.array([[keep_in[e]['m1'][0], keep_in[e]['m2'][0]] for e in self.elements])
+        self.rect_upper = np.array([[keep_in[e]['m1'][1], keep_in[e]['m2'][1]] for e in self.elements])
+        self.centers = np.array([centers[e] for e in self.elements], dtype=float)
+        self.radii_sq = np.array([radii[e] for e in self.elements], dtype=float)**2
+
+    @classmethod
+    def from_compiled(cls, compiled, motors, clearance=None):
+        """ Builds the geometry from CompiledConfigs """
+        if clearance is None:
+            clearance = {'mask': CLEARANCE_PMASK, 'fiber': CLEARANCE_FIBER}
+        base = compiled.base_configs
+        centers = {
+            'mask': (base['pinhole_mask']['m1'], base['pinhole_mask']['m2']),
+            'fiber': (base['fiber_bundle']['m1'], base['fiber_bundle']['m2']),
+        }
+        keep_in = {'mask': compiled.mask_limits, 'fiber': compiled.fiber_limits}
+        return cls(motors, compiled.limits, keep_in, centers, clearance)
+
+    def points(self, positions):
+        """ Returns positions (PCUPos, PCUPosArray, dict or array) as an (N x motors) array """
+        if isinstance(positions, np.ndarray):
+            return positions.reshape(-1, len(self.motors))
+        if hasattr(positions, 'data'): # PCUPosArray
+            return positions.data
+        if hasattr(positions, '_pos'): # PCUPos
+            return np.asarray(positions._pos).reshape(1, -1)
+        if isinstance(positions, dict):
+            return np.array([[positions.get(m, 0) for m in self.motors]], dtype=float)
+        return np.asarray(positions, dtype=float).reshape(-1, len(self.motors))
+
+    def in_limits(self, positions):
+        """ Checks which positions are within the per-axis limits """
+        pts = self.points(positions)
+        return np.all((pts >= self.lower) & (pts <= self.upper), axis=1)
+
+    def element_in_hole(self, positions):
+        """ Returns an (N x elements) array: XY inside each element's keep-in region """
+        pts = self.points(positions)
+        xy = pts[:, [self.x, self.y]][:, None, :]
+        in_rect = np.all((xy >= self.rect_lower) & (xy <= self.rect_upper), axis=2)
+        in_circle = np.sum((xy - self.centers)**2, axis=2) < self.radii_sq
+        return in_rect & in_circle
+
+    def in_hole(self, element, positions):
+        """ Checks which positions have XY inside the keep-in region of element """
+        return self.element_in_hole(positions)[:, self.elements.index(element)]
+
+    def is_valid(self, positions):
+        """ Checks which positions are within limits and collision-free """
+        pts = self.points(positions)
+        extended = pts[:, self.z] > 0
+        safe = ~extended | self.element_in_hole(pts)
+        return self.in_limits(pts) & np.all(safe, axis=1)
+
+    def corners(self, start, end):
+        """ Returns the corners (N x motors) of the box between start and end """
+        a, b = self.points(start)[0], self.points(end)[0]
+        moved = np.flatnonzero(a != b)
+        # Each corner takes every moved axis at either its start or its end
+        at_end = (np.arange(2**len(moved))[:, None] >> np.arange(len(moved))) & 1
+        corners = np.repeat(a[None, :], len(at_end), axis=0)
+        corners[:, moved] = np.where(at_end, b[moved], a[moved])
+        return corners
+
+    def path_valid(self, start, end):
+        """
+        Checks that a move from start to end is safe whatever the speeds,
+        start times and stalls of its axes: the whole box between its ends
+        must be valid. The limits are a box and each keep-in region is
+        convex, so checking the corners of the box covers all of it.
+        """
+        return bool(np.all(self.is_valid(self.corners(start, end))))
+
+    def xy_steps_valid(self, positions):
+        """
+        Checks a sequence of positions (N x motors) that differ only in X and Y,
+        visited in order. Each step may move X and Y at any relative speed, so
+        it sweeps the box between its ends; the keep-in regions are convex, so
+        checking the box corners covers the whole step. One vectorized pass.
+        """
+        pts = self.points(positions)
+        corners_x = pts[:-1].copy()
+        corners_x[:, self.x] = pts[1:, self.x]
+        corners_y = pts[:-1].copy()
+        corners_y[:, self.y] = pts[1:, self.y]
+        return bool(np.all(self.is_valid(np.vstack([pts, corners_x, corners_y]))))
+
+    def retarget_valid(self, element, current, target):
+        """
+        Checks an XY retarget of element ('fiber' or 'mask') from current
+        to target (dicts): both ends in its hole and the step between safe
+        """
+        pts = np.vstack([self.points(current), self.points(dict(current, **target))])
+        return self.xy_steps_valid(pts) and bool(np.all(self.in_hole(element, pts)))
@@ -0,0 +1,149 @@
+from bisect import bisect_left
+import functools
+import time
+
+import numpy as np
+
+from channels import ChangedChannel
+
+# Upper bin edges of latency histograms (seconds), 8 bins per decade from 1 us to 10 s
+LATENCY_EDGES = [float(e) for e in np.logspace(-6, 1, 57)]
+# Upper bin edges of CA calls per tick
+CA_EDGES = list(range(65))
+# Samples kept in each rolling histogram
+WINDOW = 1000
+# Time between updates of the statistics channels (seconds)
+PUBLISH_INTERVAL = 1.0
+
+def _camel(name):
+    """ Converts a method name (check_offsets) to a channel name (checkOffsets) """
+    first, *rest = name.split('_')
+    return first + ''.join(word.capitalize() for word in rest)
+
+# Rolling histogram class
+class RollingHistogram():
+    """
+    Histogram of the last window samples, with fixed bins.
+    Adding a sample is O(log bins); reading percentiles is O(bins).
+    """
+
+    def __init__(self, edges, window=WINDOW):
+        """ Initializes with upper bin edges (sorted list); larger samples go in an overflow bin """
+        self.edges = edges
+        self.window = window
+        self.counts = [0]*(len(edges) + 1)
+        # Bin of each sample in the window
+        self._bins = [0]*window
+        self._next = 0
+        self.n = 0
+
+    def add(self, value):
+        b = bisect_left(self.edges, value)
+        if self.n == self.window:
+            # Drop the oldest sample
+            self.counts[self._bins[self._next]] -= 1
+        else:
+            self.n += 1
+        self._bins[self._next] = b
+        self.counts[b] += 1
+        self._next = (self._next + 1) % self.window
+
+    def percentiles(self, *qs):
+        """ Returns the upper edges of the bins holding the given percentiles (0 if empty), in one pass """
+        if self.n == 0:
+            return [0]*len(qs)
+        ranks = [q/100 * self.n for q in qs]
+        values = [self.edges[-1]]*len(qs)
+        i = 0
+        total = 0
+        for b, count in enumerate(self.counts):
+            if count == 0:
+                continue
+            total += count
+            while i < len(ranks) and total >= ranks[i]:
+                values[i] = self.edges[min(b, len(self.edges) - 1)]
+                i += 1
+            if i == len(ranks):
+                break
+        return values
+
+# Sequencer statistics class
+class TickStats():
+    """
+    Low-overhead timing of the sequencer's hot path: rolling latency
+    histograms of selected methods and of whole ticks, CA calls per tick
+    and tick overruns, published as IOC channels under the prefix.
+    """
+
+    def __init__(self, ioc, prefix, names, counter=None, clock=time.perf_counter):
+        """
+        Initializes statistics for the methods in names. counter returns the
+        running number of CA calls; clock measures latencies.
+        """
+        self.names = list(names)
+        self.counter = (lambda: 0) if counter is None else counter
+        self.clock = clock
+        self.latency = {name: RollingHistogram(LATENCY_EDGES) for name in self.names + ['tick']}
+        self.ca_calls = RollingHistogram(CA_EDGES)
+        self.overruns = 0
+        self.last_publish = None
+
+        self._tick_start = None
+        self._tick_calls = 0
+
+        # Readback channels, posted on change
+        self.channels = {}
+        for name in self.names + ['tick', 'caCalls']:
+            for stat in ['P50', 'P99']:
+                chan_name = _camel(name) + stat
+                self.channels[chan_name] = ChangedChannel(ioc.registerDouble(f'{prefix}:{chan_name}'))
+        self.channels['overruns'] = ChangedChannel(ioc.registerDouble(f'{prefix}:overrunsRb'))
+
+    def wrap(self, obj):
+        """ Replaces the named methods of obj with timed versions """
+        for name in self.names:
+            method = getattr(obj, name)
+            setattr(obj, name, self.timed(name, method))
+
+    def timed(self, name, fn):
+        """ Returns fn, recording its latency under name """
+        histogram = self.latency[name]
+        clock = self.clock
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.add(clock() - start)
+        return wrapper
+
+    def begin_tick(self):
+        """ Marks the start of a tick """
+        self._tick_start = self.clock()
+        self._tick_calls = self.counter()
+
+    def end_tick(self, period):
+        """ Marks the end of a tick, which overran if it took longer than period (s) """
+        if self._tick_start is None:
+            return
+        duration = self.clock() - self._tick_start
+        self._tick_start = None
+        self.latency['tick'].add(duration)
+        self.ca_calls.add(self.counter() - self._tick_calls)
+        if duration > period:
+            self.overruns += 1
+
+    def publish(self, now):
+        """ Updates the statistics channels, at most once per PUBLISH_INTERVAL """
+        if self.last_publish is not None and now - self.last_publish < PUBLISH_INTERVAL:
+            return
+        self.last_publish = now
+
+        histograms = dict(self.latency, caCalls=self.ca_calls)
+        for name, histogram in histograms.items():
+            p50, p99 = histogram.percentiles(50, 99)
+            self.channels[_camel(name)+'P50'].set(p50)
+            self.channels[_camel(name)+'P99'].set(p99)
+        self.channels['overruns'].set(self.overruns)
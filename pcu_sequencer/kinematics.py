@@ -0,0 +1,110 @@
+import math
+
+import numpy as np
+
+# Single-axis motion model
+class MotorKinematics():
+    """ Trapezoidal velocity profile of one motor, plus a settling time """
+
+    def __init__(self, velocity, acceleration, settle=0):
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.settle = settle
+
+    def move_time(self, distance):
+        """ Returns the expected time (s) to move a distance (mm) and settle """
+        distance = abs(distance)
+        if distance == 0:
+            return 0
+        v, a = self.velocity, self.acceleration
+
+        # Too short to reach full speed: triangular profile
+        if distance < v**2 / a:
+            return 2*math.sqrt(distance / a) + self.settle
+        # Accelerate, cruise, decelerate
+        return distance/v + v/a + self.settle
+
+    def travel(self, t, distance):
+        """ Returns the distance travelled (mm) at times t (array, s) on a move of distance """
+        t = np.asarray(t, dtype=float)
+        distance = abs(distance)
+        v, a = self.velocity, self.acceleration
+
+        # Time and distance to reach peak speed
+        t_acc = min(v/a, math.sqrt(distance / a))
+        d_acc = 0.5*a*t_acc**2
+        # Time at full speed, and total time in motion
+        t_cruise = (distance - 2*d_acc) / v
+        t_total = 2*t_acc + t_cruise
+
+        return np.where(t < t_acc, 0.5*a*t**2,
+               np.where(t < t_acc + t_cruise, d_acc + a*t_acc*(t - t_acc),
+               np.where(t < t_total, distance - 0.5*a*(t_total - t)**2, distance)))
+
+# Motion model of the PCU
+class PCUKinematics():
+    """ Predicts durations and timeouts of concurrent multi-axis moves """
+
+    def __init__(self, kinematics, factor=1.5, margin=3, minimum=5, default_time=45):
+        """
+        Initializes from motor parameters (dict of velocity, acceleration
+        and settle time per motor). Moves of motors without a model get
+        default_time, and no timeout is shorter than minimum (s).
+        """
+        self.motors = {m_name: MotorKinematics(**params) for m_name, params in kinematics.items()}
+        self.factor = factor
+        self.margin = margin
+        self.minimum = minimum
+        self.default_time = default_time
+        # Where each motor's model came from ('record' or 'file')
+        self.sources = dict.fromkeys(self.motors, 'file')
+
+    @classmethod
+    def from_motor_info(cls, motor_info, records=None, default_time=45):
+        """
+        Loads the model from the motor records, if given as {m_name: {'velo': v, 'accl': t}}
+        (VELO in mm/s, ACCL in seconds to reach VELO), and from the motor file
+        for motors whose records do not report usable values
+        """
+        kinematics = {m_name: dict(params) for m_name, params in motor_info.get('kinematics', {}).items()}
+        sources = {}
+        for m_name, fields in (records or {}).items():
+            velo, accl = fields.get('velo'), fields.get('accl')
+            if velo is None or accl is None or not (velo > 0 and accl > 0):
+                continue
+            settle = kinematics.get(m_name, {}).get('settle', 0)
+            kinematics[m_name] = {'velocity': float(velo), 'acceleration': float(velo)/accl,
+                                  'settle': settle}
+            sources[m_name] = 'record'
+
+        model = cls(kinematics, default_time=default_time, **motor_info.get('move_timeout', {}))
+        model.sources.update(sources)
+        return model
+
+    def move_time(self, current, m_dict):
+        """ Returns the expected time for a move (dict) starting from current positions (dict) """
+        times = [0]
+        for m_name, m_dest in m_dict.items():
+            if m_name not in current:
+                continue
+            if m_name not in self.motors:
+                times.append(self.default_time)
+                continue
+            times.append(self.motors[m_name].move_time(m_dest - current[m_name]))
+        # Motors in a stage move at the same time
+        return max(times)
+
+    def queue_time(self, current, moves):
+        """ Returns the expected time for a list of moves, made one after another """
+        pos = dict(current)
+        total = 0
+        for m_dict in moves:
+            total += self.move_time(pos, m_dict)
+            for m_name, m_dest in m_dict.items():
+                if m_name in pos:
+                    pos[m_name] = m_dest
+        return total
+
+    def timeout(self, move_time):
+        """ Returns the timeout for a move that is expected to take move_time """
+        return max(self.minimum, self.factor*move_time + self.margin)
@@ -0,0 +1,174 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+from epics import ca
+
+from motors import CallCounter, PCUMotor, CONNECT_TIMEOUT
+
+QUEUE_SIZE = 8 # requests waiting per motor
+IO_DEADLINE = 2.0 # seconds for a queued write to start
+STOP_DEADLINE = 0.5 # seconds for a stop to start
+
+# Motor I/O worker class
+class MotorWorker():
+    """
+    Runs requests (functions) on its own thread, from a bounded queue.
+    Requests that cannot be queued, or that wait past their deadline,
+    fail instead of blocking the caller.
+    """
+
+    def __init__(self, name, size=QUEUE_SIZE):
+        self.name = name
+        self.requests = queue.Queue(maxsize=size)
+        # Requests refused or expired
+        self.dropped = 0
+        self._thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, deadline, name=None):
+        """ 
+        Queues fn to start within deadline (seconds). Returns a Future with
+        its result, named (pvname) for error messages.
+        """
+        future = Future()
+        future.pvname = self.name if name is None else name
+        try:
+            self.requests.put_nowait((time.monotonic() + deadline, fn, future))
+        except queue.Full:
+            self.dropped += 1
+            future.set_exception(queue.Full(f"{self.name} queue is full."))
+        return future
+
+    def clear(self):
+        """ Cancels all queued requests """
+        while True:
+            try:
+                _, _, future = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            future.cancel()
+
+    def run(self):
+        # Share the CA context of the thread that created the motors
+        ca.use_initial_context()
+        while True:
+            deadline, fn, future = self.requests.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if time.monotonic() > deadline:
+                self.dropped += 1
+                future.set_exception(TimeoutError(f"{self.name} request expired before it started."))
+                continue
+            try:
+                future.set_result(fn())
+            except Exception as err:
+                future.set_exception(err)
+
+# Isolated motor class
+class IsolatedMotor():
+    """
+    PCUMotor with all channel traffic kept off the caller's thread, so a
+    slow or hung IOC never stalls the state machine. Readbacks come from
+    monitors (the latest values, no CA calls). Writes go through a bounded
+    per-motor queue with deadlines, and stops through a separate priority
+    thread that also cancels queued writes.
+    """
+
+    # Same channels as PCUMotor
+    channels = PCUMotor.channels
+    snapshot_channels = PCUMotor.snapshot_channels
+
+    def __init__(self, m_name, m_type="ln", base=None):
+        self.motor = PCUMotor(m_name, m_type=m_type, base=base)
+        self.m_name = m_name
+        # Requests made by this motor (reads are served from monitors)
+        self.ca_calls = CallCounter()
+
+        # Latest monitor value of each snapshot channel
+        self.readbacks = dict.fromkeys(self.snapshot_channels)
+        for key in self.snapshot_channels:
+            getattr(self.motor, key).add_callback(self._on_readback, run_now=True, channel_key=key)
+
+        self.writes = MotorWorker(f"{m_name}IO")
+        self.stops = MotorWorker(f"{m_name}Stop", size=2)
+
+    def __getattr__(self, name):
+        # Channel names, monitors, listeners and connection state of the motor
+        if name == 'motor':
+            raise AttributeError(name)
+        return getattr(self.motor, name)
+
+    def _on_readback(self, pvname=None, value=None, channel_key=None, **kwargs):
+        """ Monitor callback, caches the value """
+        self.readbacks[channel_key] = value
+
+    @classmethod
+    def connect_many(cls, motors, timeout=CONNECT_TIMEOUT):
+        """ Same as PCUMotor.connect_many, also waiting for the first monitor values """
+        deadline = time.time() + timeout
+        missing = PCUMotor.connect_many({m_name: motor.motor for m_name, motor in motors.items()}, timeout)
+        while (any(val is None for motor in motors.values() for val in motor.readbacks.values())
+               and time.time() < deadline):
+            ca.poll(evt=0.01)
+        return missing
+
+    @classmethod
+    def read_many(cls, motors, keys):
+        """ 
+        Same as PCUMotor.read_many, from the latest monitor values (never blocks).
+        Channels without a monitor are read with PCUMotor.read_many, which blocks.
+        """
+        values = {m_name: {key: motor.readbacks[key] for key in keys if key in motor.readbacks}
+                  for m_name, motor in motors.items()}
+        unmonitored = [key for key in keys if key not in cls.snapshot_channels]
+        if len(unmonitored) != 0:
+            CallCounter.add_batch(motors)
+            read = PCUMotor.read_many({m_name: motor.motor for m_name, motor in motors.items()}, unmonitored)
+            for m_name, m_values in read.items():
+                values[m_name].update(m_values)
+        return values
+
+    def submit(self, fn, channel_key, deadline=IO_DEADLINE):
+        """ Queues a write (function) to a channel for this motor's I/O thread """
+        self.ca_calls.add()
+        return self.writes.submit(fn, deadline, name=getattr(self.motor, channel_key+"_name"))
+
+    def isEnabled(self):
+        return (not self.readbacks['enableRb']) and bool(self.readbacks['torqueRb'])
+
+    def get_pos(self):
+        self.check_connection()
+        return self.readbacks['get_chan']
+
+    def enable_async(self):
+        self.check_connection()
+        return [self.submit(self.motor.enable, 'enable_chan')]
+
+    def disable_async(self):
+        self.check_connection()
+        return [self.submit(self.motor.disable, 'enable_chan')]
+
+    def set_pos_async(self, pos):
+        self.check_connection()
+        return [self.submit(lambda: self.motor.set_pos(pos), 'set_chan')]
+
+    def stop_async(self):
+        """ Cancels queued writes and stops the motor on the priority thread """
+        self.writes.clear()
+        self.ca_calls.add()
+        return [self.stops.submit(self.motor.stop, STOP_DEADLINE, name=self.motor.spmg_name)]
+
+    def enable(self):
+        self.enable_async()[0].result(timeout=IO_DEADLINE)
+
+    def disable(self):
+        self.disable_async()[0].result(timeout=IO_DEADLINE)
+
+    def set_pos(self, pos):
+        self.set_pos_async(pos)[0].result(timeout=IO_DEADLINE)
+
+    def stop(self):
+        # Don't wait on a hung channel
+        self.stop_async()
@@ -1,10 +1,45 @@
-from epics import PV
+from concurrent.futures import Future, wait
+import threading
+import time
+
+from epics import PV, ca, caget_many
 from kPySequencer.Sequencer import Sequencer, PVDisconnectException, PVConnectException
 
+CONNECT_TIMEOUT = 5 # seconds, for all motor channels at startup
+LAZY_TIMEOUT = 1 # seconds, for channels created on first use
+
+# Channel Access operation counter
+class CallCounter():
+    """ Counts Channel Access operations, safely from any thread """
+    
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+    
+    def add(self, n=1):
+        with self._lock:
+            self.value += n
+    
+    @staticmethod
+    def add_batch(motors):
+        """ Counts one batched operation over several motors (dict), against the first """
+        for motor in motors.values():
+            motor.ca_calls.add()
+            break
+
+def gather(futures, timeout=None):
+    """ 
+    Waits for several puts (futures) to complete together. Returns the
+    futures that did not complete within timeout (seconds), or failed.
+    """
+    done, not_done = wait(futures, timeout=timeout)
+    failed = [f for f in done if f.cancelled() or f.exception() is not None]
+    return failed + list(not_done)
+
 # Motor class
 class PCUMotor():
     
-    # Patterns for motor functions
+    # Patterns for motor functions (default base, see __init__)
     base_pattern = "k1:ao:pcu"
     channels = {
         'get_chan': ":posvalRb",
@@ -19,60 +54,204 @@ class PCUMotor():
         'torqueRb': ':enableTorqueRb',
         'moving': '.MOVN',
         'spmg': '.SPMG',
+        # Motor record speed (EGU/s) and time to reach it (s)
+        'velo': '.VELO',
+        'accl': '.ACCL',
     }
-    
-    def __init__(self, m_name, m_type="ln"):
-        
+    # Readback channels captured in each sequencer tick (see PCUSnapshot)
+    snapshot_channels = ['get_chan', 'moving', 'enableRb', 'torqueRb']
+    # Channels created at startup; the rest are created on first use
+    startup_channels = snapshot_channels + ['set_chan', 'go_chan', 'enable_chan', 'torque_chan', 'spmg']
+    def __init__(self, m_name, m_type="ln", base=None):
+        """ Connects to the channels of motor m_name under base (e.g. k2:ao:pcu) """
+        self.m_name = m_name
+        self.m_type = m_type
+        self.base = PCUMotor.base_pattern if base is None else base
+        # Channel Access operations made by this motor (a batch counts once)
+        self.ca_calls = CallCounter()
         self.channel_list = []
+        # Connection state of each channel, kept up to date by callbacks
+        self._connected = {}
+        self.connected = False
+        # Whether the initial (blocking) connection has been made
+        self._initialized = False
         
-        # Set up all channel PVs as attributes
+        # Full names of all channels
         for channel_key, channel_pat in PCUMotor.channels.items():
-            # Assemble full channel name
-            full_channel = f"{PCUMotor.base_pattern}:{m_type}:{m_name}{channel_pat}"
-            # Create EPICS PV
-            channel_PV = PV(full_channel)
-            self.channel_list.append(channel_PV)
-            # Set attribute
-            setattr(self, channel_key, channel_PV)
-            # Set attribute name
-            setattr(self, channel_key+"_name", full_channel)
+            setattr(self, channel_key+"_name", f"{self.base}:{m_type}:{m_name}{channel_pat}")
+        
+        # Set up the startup channel PVs as attributes
+        # (creating a PV only starts its connection)
+        for channel_key in PCUMotor.startup_channels:
+            self._connected[getattr(self, channel_key+"_name")] = False
+            self._add_channel(channel_key)
+        
+        # Latest position and motion state from monitors
+        self.position = None
+        self.move_state = None
+        # Functions called with this motor on every monitor update
+        self.listeners = []
+        self.get_chan.add_callback(self._on_monitor)
+        self.moving.add_callback(self._on_monitor)
+    
+    def _add_channel(self, channel_key):
+        """ Creates the PV of a channel and sets it as an attribute """
+        channel_PV = PV(getattr(self, channel_key+"_name"), connection_callback=self._on_connection)
+        self.channel_list.append(channel_PV)
+        setattr(self, channel_key, channel_PV)
+        return channel_PV
+    
+    def __getattr__(self, name):
+        # Channels that are not needed at startup are created on first use
+        if name in PCUMotor.channels and name not in PCUMotor.startup_channels:
+            channel_PV = self._add_channel(name)
+            channel_PV.wait_for_connection(timeout=LAZY_TIMEOUT)
+            return channel_PV
+        raise AttributeError(f"'PCUMotor' object has no attribute '{name}'")
+    
+    @classmethod
+    def connect_many(cls, motors, timeout=CONNECT_TIMEOUT):
+        """ 
+        Waits for the channels of several motors (dict) to connect in parallel,
+        with one overall timeout. Returns the names of channels that did not connect.
+        """
+        pvs = [pv for motor in motors.values() for pv in motor.channel_list]
+        deadline = time.time() + timeout
+        while not all(pv.connected for pv in pvs) and time.time() < deadline:
+            ca.poll(evt=0.01)
+        
+        for motor in motors.values():
+            # No need for a blocking connect in check_connection
+            motor._initialized = True
+            motor.connected = all(pv.connected for pv in motor.channel_list)
+        return [pv.pvname for pv in pvs if not pv.connected]
+    
+    @classmethod
+    def read_many(cls, motors, keys):
+        """ 
+        Reads channels (keys) of several motors (dict) in one batched CA operation.
+        Returns a dictionary of {m_name: {key: value}}, with None for no response.
+        """
+        # Flatten channel names in motor, key order
+        pvnames = [getattr(motor, key+"_name") for motor in motors.values() for key in keys]
+        values = iter(caget_many(pvnames))
+        CallCounter.add_batch(motors)
+        
+        return {m_name: {key: next(values) for key in keys} for m_name in motors}
+    
+    def _on_connection(self, pvname=None, conn=None, **kwargs):
+        """ Connection callback, updates the cached 'all connected' flag """
+        self._connected[pvname] = bool(conn)
+        self.connected = all(self._connected.values())
+    
+    def _on_monitor(self, pvname=None, value=None, **kwargs):
+        """ Monitor callback for the position and .MOVN channels """
+        if pvname == self.get_chan_name:
+            self.position = value
+        else:
+            self.move_state = value
+        # Notify listeners (e.g. the move completion engine)
+        for listener in self.listeners:
+            listener(self)
+    
+    def add_listener(self, listener):
+        """ Adds a function to be called on position or motion updates """
+        self.listeners.append(listener)
     
     def check_connection(self):
-        for pv in self.channel_list:
-            if not pv.connect():
-                raise PVDisconnectException(f"Channel {pv.pvname} has disconnected.")
+        """ Raises PVDisconnectException if any channel is disconnected """
+        # Hot path: cached flag from connection callbacks
+        if self.connected:
+            return
+        
+        # Give channels one chance to connect at startup
+        if not self._initialized:
+            self._initialized = True
+            for pv in self.channel_list:
+                pv.connect()
+            self.connected = all(pv.connected for pv in self.channel_list)
+            if self.connected:
+                return
+        
+        # Report the first disconnected channel
+        for pv_name, conn in self._connected.items():
+            if not conn:
+                raise PVDisconnectException(f"Channel {pv_name} has disconnected.")
+        raise PVDisconnectException("Motor channels have disconnected.")
     
     def isEnabled(self):
         """ Checks whether the motor is enabled """
         # Software enable channel is backwards
         # Torque enable works fine
+        self.ca_calls.add(2)
         return (not self.enableRb.get()) and self.torqueRb.get()
     
     def enable(self):
         """ Enables the motor """
         self.check_connection()
+        self.ca_calls.add(2)
         self.enable_chan.put(0) # Enable software
         self.torque_chan.put(1) # Enable torque
     
     def disable(self):
         """ Disables the motor """
         self.check_connection()
+        self.ca_calls.add(2)
         self.torque_chan.put(0) # Disable torque
         self.enable_chan.put(1) # Disable software
     
+    def put_async(self, channel_key, value):
+        """ 
+        Starts a put without waiting for it. Returns a Future that completes
+        (with the channel name) when the IOC has processed the put.
+        """
+        pv = getattr(self, channel_key)
+        future = Future()
+        future.pvname = pv.pvname
+        # Runs in the CA thread, so only the future is touched
+        def on_complete(pvname=None, **kwargs):
+            future.set_result(pvname)
+        self.ca_calls.add()
+        pv.put(value, wait=False, callback=on_complete)
+        return future
+    
+    def enable_async(self):
+        """ Starts enabling the motor, returns a list of Futures """
+        self.check_connection()
+        # Puts on one IOC are processed in order
+        return [self.put_async('enable_chan', 0), self.put_async('torque_chan', 1)]
+    
+    def disable_async(self):
+        """ Starts disabling the motor, returns a list of Futures """
+        self.check_connection()
+        return [self.put_async('torque_chan', 0), self.put_async('enable_chan', 1)]
+    
+    def set_pos_async(self, pos):
+        """ Starts a move to pos, returns a list of Futures """
+        self.check_connection()
+        return [self.put_async('set_chan', pos), self.put_async('go_chan', 1)]
+    
+    def stop_async(self):
+        """ Starts stopping the motor (no connection check), returns a list of Futures """
+        return [self.put_async('spmg', 'Stop')]
+    
     def isMoving(self):
-        return self.moving
+        """ Checks whether the motor is moving (from the .MOVN monitor) """
+        return bool(self.move_state)
     
     def get_pos(self):
         self.check_connection()
+        self.ca_calls.add()
         return self.get_chan.get()
 
     def set_pos(self, pos):
         self.check_connection()
+        self.ca_calls.add(2)
         self.set_chan.put(pos)
         self.go_chan.put(1)
 
     def stop(self): 
         # Important that this doesn't check connection,
         # as a stop can result from a disconnect exception
+        self.ca_calls.add()
         self.spmg.put('Stop')
\ No newline at end of file
@@ -0,0 +1,98 @@
+import numpy as np
+
+# Golden angle, for evenly filled spirals
+GOLDEN_ANGLE = np.pi*(3 - np.sqrt(5))
+# Largest number of points in a pattern (nearest-neighbor ordering is N^2)
+MAX_POINTS = 1000
+
+def grid(nx, ny, dx, dy=None):
+    """ Returns an nx by ny grid of XY offsets (N x 2), centered on zero """
+    dy = dx if dy is None else dy
+    x = (np.arange(nx) - (nx-1)/2) * dx
+    y = (np.arange(ny) - (ny-1)/2) * dy
+    xx, yy = np.meshgrid(x, y)
+    return np.column_stack([xx.ravel(), yy.ravel()])
+
+def spiral(n, step):
+    """ Returns n XY offsets (N x 2) on a spiral from zero, about step apart """
+    k = np.arange(n)
+    r = step * np.sqrt(k)
+    theta = k * GOLDEN_ANGLE
+    return np.column_stack([r*np.cos(theta), r*np.sin(theta)])
+
+def serpentine(points):
+    """ Orders points row by row (in Y), alternating direction in X """
+    points = np.asarray(points, dtype=float)
+    rows = np.unique(points[:, 1])
+    ordered = []
+    for i, y in enumerate(rows):
+        row = points[points[:, 1] == y]
+        row = row[np.argsort(row[:, 0])]
+        ordered.append(row if i % 2 == 0 else row[::-1])
+    return np.concatenate(ordered) if ordered else points
+
+def nearest_neighbor(points, start=(0, 0)):
+    """ Orders points by always visiting the closest unvisited point next """
+    points = np.asarray(points, dtype=float)
+    remaining = np.ones(len(points), dtype=bool)
+    order = []
+    pos = np.asarray(start, dtype=float)
+    for _ in range(len(points)):
+        dist = np.sum((points - pos)**2, axis=1)
+        dist[~remaining] = np.inf
+        idx = int(np.argmin(dist))
+        order.append(idx)
+        remaining[idx] = False
+        pos = points[idx]
+    return points[order]
+
+def path_length(points, start=(0, 0)):
+    """ Returns the total XY travel to visit points in order from start """
+    path = np.vstack([np.asarray(start, dtype=float), np.asarray(points, dtype=float)])
+    return float(np.sum(np.linalg.norm(np.diff(path, axis=0), axis=1)))
+
+def check_size(n):
+    """ Raises ValueError if a pattern of n points is empty or too large """
+    if n < 1:
+        raise ValueError("Pattern has no points.")
+    if n > MAX_POINTS:
+        raise ValueError(f"Pattern has {n} points, the limit is {MAX_POINTS}.")
+
+def parse_pattern(spec):
+    """
+    Parses a pattern request and returns ordered XY offsets (N x 2):
+      'grid <nx> <ny> <dx> [<dy>]'  - serpentine raster
+      'spiral <n> <step>'           - spiral from the center
+      'list <x>,<y> <x>,<y> ...'    - explicit offsets
+    Patterns other than grids are ordered by nearest neighbor.
+    Raises ValueError for bad requests, including patterns of more than MAX_POINTS.
+    """
+    words = spec.split()
+    if len(words) == 0:
+        raise ValueError("Empty pattern request.")
+    kind, args = words[0].lower(), words[1:]
+
+    if kind == 'grid':
+        if len(args) not in [3, 4]:
+            raise ValueError("Use 'grid <nx> <ny> <dx> [<dy>]'.")
+        nx, ny = int(args[0]), int(args[1])
+        check_size(nx*ny if nx > 0 and ny > 0 else 0)
+        points = serpentine(grid(nx, ny, *[float(a) for a in args[2:]]))
+    elif kind == 'spiral':
+        if len(args) != 2:
+            raise ValueError("Use 'spiral <n> <step>'.")
+        n = int(args[0])
+        check_size(n)
+        points = nearest_neighbor(spiral(n, float(args[1])))
+    elif kind == 'list':
+        check_size(len(args))
+        points = [[float(v) for v in a.split(',')] for a in args]
+        if any(len(p) != 2 for p in points):
+            raise ValueError("Use 'list <x>,<y> <x>,<y> ...'.")
+        points = nearest_neighbor(points)
+    else:
+        raise ValueError(f"Unknown pattern type '{kind}'.")
+
+    if not np.all(np.isfinite(points)):
+        raise ValueError("Pattern offsets must be finite.")
+    return points
@@ -0,0 +1,143 @@
+from positions import PCUPos
+
+HOME = 0 # mm
+
+# Move planner class
+class MovePlanner():
+    """
+    Splits a reconfiguration into the fewest stages of concurrent motor moves:
+    Z stages home first, X and Y move together, then Z stages extend.
+    Moves that stay inside one keep-in region of the K-mirror rotator
+    are made in a single stage, without homing the Z stages.
+    With a geometry, every stage is checked to be safe for any relative
+    timing of its axes. Consecutive stages are combined when that still
+    holds, but Z stages are never combined with X and Y.
+    """
+
+    # FIX Z-STAGE
+    xy_motors = ['m1', 'm2']
+    z_motors = ['m3', 'm4']
+
+    def __init__(self, valid_motors, tolerance, geometry=None):
+        """
+        Initializes a planner for the given motors and tolerances (dict).
+        Paths are checked against geometry (PCUGeometry) if given.
+        """
+        self.valid_motors = list(valid_motors)
+        self.tolerance = tolerance
+        self.geometry = geometry
+
+    def at_position(self, m_name, pos, dest):
+        """ Checks whether pos and dest are the same within tolerance """
+        return abs(pos - dest) < self.tolerance[m_name]
+
+    def changed(self, motors, current, destination):
+        """ Returns a stage (dict) of the motors that have to move to reach destination """
+        return {m_name: getattr(destination, m_name) for m_name in motors
+                if m_name in self.valid_motors and
+                not self.at_position(m_name, getattr(current, m_name), getattr(destination, m_name))}
+
+    @staticmethod
+    def after(pos, stage):
+        """ Returns the position (PCUPos) after a stage is made from pos """
+        new_pos = PCUPos(pos.mdict, geometry=pos.geometry)
+        for m_name, m_dest in stage.items():
+            setattr(new_pos, m_name, m_dest)
+        return new_pos
+
+    def retracts(self, pos, stage):
+        """ Checks whether a stage only moves Z stages toward HOME, from pos """
+        return all(m_name in self.z_motors and
+                   abs(m_dest - HOME) <= abs(getattr(pos, m_name) - HOME)
+                   for m_name, m_dest in stage.items())
+
+    def stage_valid(self, pos, stage):
+        """ 
+        Checks the path of a stage starting at pos, for any timing of its axes.
+        Retracting Z stages with X and Y fixed is always allowed: it cannot
+        cause a new collision, and it is the way out of an invalid position.
+        """
+        if self.geometry is None or self.retracts(pos, stage):
+            return True
+        return self.geometry.path_valid(pos, self.after(pos, stage))
+
+    def mixes_z(self, stage):
+        """ Checks whether a stage moves Z stages together with X or Y """
+        return (any(m_name in self.z_motors for m_name in stage) and
+                any(m_name in self.xy_motors for m_name in stage))
+
+    def check(self, current, stages):
+        """ Returns the index of the first stage with an unsafe path, or None """
+        pos = current
+        for i, stage in enumerate(stages):
+            if not self.stage_valid(pos, stage):
+                return i
+            pos = self.after(pos, stage)
+        return None
+
+    def merge(self, current, stages):
+        """ 
+        Combines consecutive stages on different motors if their joint path is
+        safe. A Z stage is never combined with X and Y: if Z stalls or starts
+        late, X and Y would drive the extended element out of the hole.
+        """
+        if self.geometry is None:
+            return stages
+
+        merged = []
+        # Position before the last merged stage
+        pos = current
+        for stage in stages:
+            if len(merged) != 0 and not set(stage) & set(merged[-1]):
+                combined = dict(merged[-1], **stage)
+                if not self.mixes_z(combined) and self.stage_valid(pos, combined):
+                    merged[-1] = combined
+                    continue
+            if len(merged) != 0:
+                pos = self.after(pos, merged[-1])
+            merged.append(stage)
+        return merged
+
+    def plan(self, current, destination):
+        """
+        Returns a list of stages (dicts of motor destinations) that take
+        the PCU from current to destination (PCUPos)
+        """
+        # Fast path: both ends in the same hole. A hole is the intersection
+        # of a rectangle and a circle, which is convex but not axis-aligned,
+        # so axes moving at different speeds can still leave it. All axes
+        # only move together if the whole box between the ends is valid.
+        if self.geometry is not None and current.move_in_hole(destination):
+            stage = self.changed(self.valid_motors, current, destination)
+            if len(stage) == 0:
+                return []
+            if self.stage_valid(current, stage):
+                return [stage]
+
+        stages = []
+        # Position after each stage
+        pos = PCUPos(current.mdict, geometry=current.geometry)
+
+        xy_stage = self.changed(self.xy_motors, pos, destination)
+
+        # Home Z stages before moving X and Y
+        if len(xy_stage) != 0:
+            home = PCUPos(pos.mdict, geometry=pos.geometry)
+            for m_name in self.z_motors:
+                setattr(home, m_name, HOME)
+            z_stage = self.changed(self.z_motors, pos, home)
+            if len(z_stage) != 0:
+                stages.append(z_stage)
+                pos = home
+
+        # Move X and Y together
+        if len(xy_stage) != 0:
+            stages.append(xy_stage)
+            pos = self.after(pos, xy_stage)
+
+        # Extend (or adjust) Z stages
+        z_stage = self.changed(self.z_motors, pos, destination)
+        if len(z_stage) != 0:
+            stages.append(z_stage)
+
+        return self.merge(current, stages)
@@ -1,43 +1,53 @@
+from array import array
+
+import numpy as np
+
 import PCU_util as util
+from geometry import PCUGeometry
+
+# Collision model of positions made without one, from the shared files
+_default = {'compiled': None, 'geometry': None}
+
+def default_geometry():
+    """ Returns the collision model of the configuration files in PCU_util, rebuilt if they change """
+    compiled = util.store.load()
+    if _default['compiled'] is not compiled:
+        _default['geometry'] = PCUGeometry.from_compiled(compiled, PCUPos.valid_motors)
+        _default['compiled'] = compiled
+    return _default['geometry']
 
 # Position class
 class PCUPos():
     
+    # Fixed layout, one float per motor
+    __slots__ = ('_pos', 'name', 'geometry')
+    
     valid_motors = ['m1', 'm2', 'm3', 'm4'] ### CHANGE THIS BEFORE USING
-    fiber_limits = util.fiber_limits
-    mask_limits = util.mask_limits
     
-    def __init__(self, pos_dict=None, name=None, **kwargs):
-        """ 
+    def __init__(self, pos_dict=None, name=None, geometry=None, **kwargs):
+        """
         Initializes a position with a dictionary or with m# arguments.
         Valid motors that are not specified will be set to zero.
+        Collision checks use geometry (PCUGeometry), or the default one.
         """
-        self._mdict = {}
         # Check inputs
         if pos_dict is None:
             pos_dict = kwargs
         
-        # Load motor positions
-        for m_name in PCUPos.valid_motors:
-            # Set motor position, zero if not specified
-            pos = pos_dict[m_name] if m_name in pos_dict else 0
-            self._mdict[m_name] = pos
-            self.add_property(m_name)
+        # Load motor positions, zero if not specified
+        self._pos = array('d', [pos_dict[m_name] if m_name in pos_dict else 0
+                                for m_name in PCUPos.valid_motors])
         
         self.name = '(unnamed)' if name is None else name
+        self.geometry = geometry
     
-    def add_property(self, m_name):
-        """ Adds a property for individual motors """
-        # Define setter function
-        def setter(self, val):
-            self._mdict[m_name] = val
-        # Define getter function
-        getter = lambda self: self._mdict[m_name]
-        setattr(PCUPos, m_name, property(getter, setter))
+    def get_geometry(self):
+        """ Returns the collision model of this position """
+        return default_geometry() if self.geometry is None else self.geometry
     
     def __str__(self):
         string = f"Position {self.name}: ["
-        string += ', '.join([f'{m}: {val}' for m,val in self._mdict.items()])
+        string += ', '.join([f'{m}: {val}' for m,val in zip(PCUPos.valid_motors, self._pos)])
         string += ']'
         return string
     
@@ -45,24 +55,22 @@ class PCUPos():
         return str(self)
     
     def __add__(self, other):
-        new_dict = {}
-        for m_name, val in self.mdict.items():
-            # Check for motor mismatch
-            if m_name not in other.mdict: raise ValueError("Cannot add positions.")
-            # Add to new dictionary
-            new_dict[m_name] = val + other.mdict[m_name]
-        return PCUPos(new_dict)
+        new_pos = PCUPos.__new__(PCUPos)
+        new_pos._pos = array('d', [a + b for a, b in zip(self._pos, other._pos)])
+        new_pos.name = '(unnamed)'
+        new_pos.geometry = self.geometry
+        return new_pos
     
     @property
     def mdict(self):
-        """ Returns a dictionary of positions """
-        return self._mdict
+        """ Returns a (new) dictionary of positions """
+        return dict(zip(PCUPos.valid_motors, self._pos))
     
     def is_between(self, m_name, limits):
         """ Checks whether a motor position is within the limit array """
         if m_name not in PCUPos.valid_motors:
             raise ValueError(f"{m_name} is not a valid motor.")
-        num = self._mdict[m_name]
+        num = getattr(self, m_name)
         return num >= limits[0] and num <= limits[1]
     
     def in_limits(self, limits):
@@ -74,46 +82,117 @@ class PCUPos():
         
         return True
     
-    def in_hole(self, instrument): # May need to move to sequencer.py
-        """ Determines whether a position is in the limits for the 'fiber' or 'mask' configurations """
-        # Get the correct set of limits
-        if instrument=='fiber':
-            limits = PCUPos.fiber_limits
-        elif instrument=='mask':
-            limits = PCUPos.mask_limits
-        else:
+    def in_hole(self, instrument):
+        """ Determines whether a position is in the keep-in region for the 'fiber' or 'mask' configurations """
+        if instrument not in self.get_geometry().elements:
             print("Unknown limit type")
             return None
-
-        return self.in_limits(limits)
-    
-    def is_valid(self): # May need to move to sequencer.py
-        """ Checks whether a position is valid or not """
-        valid = True
-        
-        # Check for m3 collisions
-        if 'm3' in PCUPos.valid_motors and self.m3 > 0:
-            if not self.in_hole('mask'): valid = False
-        # Check for m4 collisions
-        if 'm4' in PCUPos.valid_motors and self.m4 > 0:
-            if not self.in_hole('fiber'): valid = False
         
-        ### TODO: Add a check for motor limits
-        
-        return valid
+        return bool(self.get_geometry().in_hole(instrument, self)[0])
+    
+    def is_valid(self):
+        """ Checks whether a position is valid (motor limits and collisions) """
+        return bool(self.get_geometry().is_valid(self)[0])
     
     def move_in_hole(self, other):
         """ Checks whether a move takes place in the hole of the k-rotator """
+        # Both ends are checked against this position's geometry
+        geometry = self.get_geometry()
+        ends = PCUPosArray.from_positions([self, other])
+        
         # Check both are valid
-        if not self.is_valid() or not other.is_valid():
+        if not all(geometry.is_valid(ends)):
             return False
         
-        # Check for pinhole mask mini-moves
-        if self.in_hole('mask') and other.in_hole('mask'):
-            return True
-        
-        # Check for fiber mini-moves
-        if self.in_hole('fiber') and other.in_hole('fiber'):
-            return True
-        
-        return False
\ No newline at end of file
+        # Check for pinhole mask or fiber mini-moves (same hole at both ends)
+        in_hole = geometry.element_in_hole(ends)
+        return bool(any(in_hole[0] & in_hole[1]))
+
+def _motor_property(idx):
+    """ Returns a property for the motor stored at index idx """
+    def getter(self):
+        return self._pos[idx]
+    def setter(self, val):
+        self._pos[idx] = val
+    return property(getter, setter)
+
+# Add a property for each motor, once
+for _idx, _m_name in enumerate(PCUPos.valid_motors):
+    setattr(PCUPos, _m_name, _motor_property(_idx))
+
+# Position array class
+class PCUPosArray():
+    """ N positions stored as one (N x motors) NumPy matrix, with vectorized checks """
+    
+    __slots__ = ('data', 'geometry')
+    
+    def __init__(self, data, geometry=None):
+        """ 
+        Initializes from an (N x motors) array, in PCUPos.valid_motors order.
+        Collision checks use geometry (PCUGeometry), or the default one.
+        """
+        self.data = np.array(data, dtype=float).reshape(-1, len(PCUPos.valid_motors))
+        self.geometry = geometry
+    
+    @classmethod
+    def from_positions(cls, positions, geometry=None):
+        """ Initializes from a list of PCUPos (geometry defaults to the first one's) """
+        if geometry is None and len(positions) != 0:
+            geometry = positions[0].geometry
+        return cls([pos._pos for pos in positions], geometry=geometry)
+    
+    @classmethod
+    def from_dicts(cls, pos_dicts, geometry=None):
+        """ Initializes from a list of position dictionaries (missing motors are zero) """
+        return cls([[d.get(m_name, 0) for m_name in PCUPos.valid_motors] for d in pos_dicts],
+                   geometry=geometry)
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def __getitem__(self, idx):
+        """ Returns a single PCUPos, or a PCUPosArray for slices and masks """
+        if isinstance(idx, (int, np.integer)):
+            return PCUPos(dict(zip(PCUPos.valid_motors, self.data[idx].tolist())), geometry=self.geometry)
+        return PCUPosArray(self.data[idx], geometry=self.geometry)
+    
+    def __str__(self):
+        return f"PCUPosArray of {len(self)} positions"
+    
+    def __repr__(self):
+        return str(self)
+    
+    def __add__(self, other):
+        """ Adds a PCUPosArray (elementwise), a PCUPos or an array (broadcast) """
+        if isinstance(other, PCUPosArray):
+            other = other.data
+        elif isinstance(other, PCUPos):
+            other = np.asarray(other._pos)
+        return PCUPosArray(self.data + other, geometry=self.geometry)
+    
+    def get_geometry(self):
+        """ Returns the collision model of these positions """
+        return default_geometry() if self.geometry is None else self.geometry
+    
+    def column(self, m_name):
+        """ Returns the positions of one motor (a view) """
+        return self.data[:, PCUPos.valid_motors.index(m_name)]
+    
+    def in_limits(self, limits):
+        """ Checks which positions are within the given limits (dict) """
+        inside = np.ones(len(self), dtype=bool)
+        for m_name in PCUPos.valid_motors:
+            if m_name in limits:
+                col = self.column(m_name)
+                inside &= (col >= limits[m_name][0]) & (col <= limits[m_name][1])
+        return inside
+    
+    def in_hole(self, instrument):
+        """ Checks which positions are in the keep-in region for 'fiber' or 'mask' """
+        if instrument not in self.get_geometry().elements:
+            raise ValueError(f"Unknown limit type {instrument}")
+        return self.get_geometry().in_hole(instrument, self)
+    
+    def is_valid(self):
+        """ Checks which positions are valid (same rules as PCUPos.is_valid) """
+        return self.get_geometry().is_valid(self)
@@ -0,0 +1,470 @@
+### replay.py : Records the PV traffic of a PCU sequencer, and replays it without hardware
+### Date : 10/17/26
+
+from collections import deque, namedtuple
+from concurrent.futures import Future
+import argparse
+import numbers
+import struct
+import threading
+import time
+
+from kPySequencer.Sequencer import PVDisconnectException
+
+from motors import CallCounter, PCUMotor
+from PCU_util import keep_previous
+
+MAGIC = b'PCUTRF01'
+
+# Event kinds
+META, KEY, TICK, ADVANCE, READ, MONITOR, CONNECT, INPUT, WRITE = range(9)
+KIND_NAMES = ['META', 'KEY', 'TICK', 'ADVANCE', 'READ', 'MONITOR', 'CONNECT', 'INPUT', 'WRITE']
+
+# Event header: kind, stream (thread), key (interned name), time
+_HEADER = struct.Struct('<BBHd')
+_LENGTH = struct.Struct('<H')
+_FLOAT = struct.Struct('<d')
+_INT = struct.Struct('<q')
+
+# Control channels read by the sequencer (attribute names)
+INPUT_CHANNELS = ['_pos', '_pattern', '_patternDwell', '_track', '_m1Track', '_m2Track']
+
+# One logged event
+Event = namedtuple('Event', ['kind', 'stream', 'name', 'time', 'value'])
+
+class ReplayError(Exception):
+    """ The replayed sequencer did not follow the recorded traffic """
+    pass
+
+def input_channels(sequencer):
+    """ Returns the attribute names of all control channels read by a sequencer """
+    return INPUT_CHANNELS + [f"_{m_name}{chan_type}" for m_name in sequencer.motors
+                             for chan_type in ['Offset', 'Pos']]
+
+def channel_key(m_name, key):
+    """ Returns the logged name of a motor channel (same for all motor backends) """
+    return f"{m_name}.{key}"
+
+def encode(value):
+    """ Encodes a channel value as a type tag and payload """
+    if value is None:
+        return b'N'
+    if isinstance(value, bytes):
+        value = value.decode('UTF-8', 'replace')
+    if isinstance(value, str):
+        data = value.encode('UTF-8')
+        return b's' + _LENGTH.pack(len(data)) + data
+    if isinstance(value, numbers.Integral):
+        return b'i' + _INT.pack(int(value))
+    if isinstance(value, numbers.Real):
+        return b'f' + _FLOAT.pack(float(value))
+    return encode(str(value))
+
+def decode(data, offset):
+    """ Decodes a value at offset, returns the value and the next offset """
+    tag = data[offset:offset+1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'i':
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    if tag == b'f':
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag == b's':
+        length = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        return data[offset:offset+length].decode('UTF-8'), offset + length
+    raise ValueError(f"Bad value tag {tag} at byte {offset-1}.")
+
+def read_traffic(path):
+    """ Returns the events (list of Event) in a traffic log """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a PCU traffic log.")
+
+    names = {}
+    events = []
+    offset = len(MAGIC)
+    while offset + _HEADER.size <= len(data):
+        kind, stream, key, now = _HEADER.unpack_from(data, offset)
+        try:
+            value, next_offset = decode(data, offset + _HEADER.size)
+        except (ValueError, struct.error, UnicodeDecodeError):
+            # Log cut short mid-event
+            break
+        offset = next_offset
+        if kind == KEY:
+            names[key] = value
+        else:
+            events.append(Event(kind, stream, names[key], now, value))
+    return events
+
+# Recording channel class
+class TapChannel():
+    """ Passes the values read from a control channel through a recorder or player """
+
+    def __init__(self, channel, name, traffic):
+        self.channel = channel
+        self.name = name
+        self.traffic = traffic
+
+    def __getattr__(self, name):
+        return getattr(self.channel, name)
+
+    def get(self):
+        return self.traffic.input(self.name, self.channel.get())
+
+    def set(self, val):
+        self.channel.set(val)
+
+# Traffic recorder class
+class TrafficRecorder():
+    """
+    Streams everything a sequencer reads from and writes to its channels
+    to a compact binary log: motor readbacks, monitor values, connection
+    checks, control inputs and motor writes, plus the start of every tick
+    and completion engine wake-up. Channel names are interned, and each
+    thread gets its own stream so its events can be replayed in order.
+    """
+
+    def __init__(self, path):
+        """ Starts a log at path; an existing log there is renamed and kept """
+        self.path = path
+        keep_previous(path)
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.keys = {}
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.clock = None
+
+    def write(self, kind, name, value=None):
+        """ Appends an event (ignored once the log is closed) """
+        with self.lock:
+            if self.file.closed:
+                return
+            key = self.keys.get(name)
+            if key is None:
+                key = self.keys[name] = len(self.keys)
+                self.file.write(_HEADER.pack(KEY, 0, key, 0) + encode(name))
+            stream = self.streams.setdefault(threading.get_ident(), len(self.streams) % 256)
+            self.file.write(_HEADER.pack(kind, stream, key, self.clock.time()) + encode(value))
+
+    def attach(self, sequencer):
+        """ Hooks into the motors, control channels and move queue of a sequencer """
+        self.clock = sequencer.clock
+        self.write(META, 'prefix', sequencer.prefix)
+        self.write(META, 'digest', sequencer.compiled.digest)
+
+        sequencer.motors = {m_name: RecordingMotor(motor, self) for m_name, motor in sequencer.motors.items()}
+        for attr in input_channels(sequencer):
+            setattr(sequencer, attr, TapChannel(getattr(sequencer, attr), attr[1:], self))
+
+        # Wake-ups of the completion engine
+        advance_moves = sequencer.advance_moves
+        def advance():
+            self.write(ADVANCE, 'advance')
+            return advance_moves()
+        sequencer.advance_moves = advance
+
+    def tick(self, state):
+        """ Marks the start of a tick in state (name) """
+        self.write(TICK, state)
+        # Keep the log current up to the last tick
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def input(self, name, value):
+        """ Records a control input """
+        self.write(INPUT, name, value)
+        return value
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+# Recording motor class
+class RecordingMotor():
+    """ Wraps a motor (PCUMotor or compatible), recording its traffic """
+
+    snapshot_channels = PCUMotor.snapshot_channels
+
+    def __init__(self, motor, recorder):
+        self.motor = motor
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        if name == 'motor':
+            raise AttributeError(name)
+        return getattr(self.motor, name)
+
+    @classmethod
+    def connect_many(cls, motors, **kwargs):
+        inner = {m_name: motor.motor for m_name, motor in motors.items()}
+        return type(next(iter(inner.values()))).connect_many(inner, **kwargs)
+
+    @classmethod
+    def read_many(cls, motors, keys):
+        inner = {m_name: motor.motor for m_name, motor in motors.items()}
+        values = type(next(iter(inner.values()))).read_many(inner, keys)
+        for m_name, m_values in values.items():
+            motor = motors[m_name]
+            for key, val in m_values.items():
+                motor.recorder.write(READ, channel_key(m_name, key), val)
+        return values
+
+    def check_connection(self):
+        try:
+            self.motor.check_connection()
+        except PVDisconnectException:
+            self.recorder.write(CONNECT, self.m_name, 0)
+            raise
+        self.recorder.write(CONNECT, self.m_name, 1)
+
+    @property
+    def position(self):
+        val = self.motor.position
+        self.recorder.write(MONITOR, channel_key(self.m_name, 'get_chan'), val)
+        return val
+
+    @property
+    def move_state(self):
+        val = self.motor.move_state
+        self.recorder.write(MONITOR, channel_key(self.m_name, 'moving'), val)
+        return val
+
+    def isMoving(self):
+        return bool(self.move_state)
+
+    def _write(self, key, value, fn, *args):
+        """ Records a write to a channel (key), and a disconnect if it fails on one """
+        self.recorder.write(WRITE, channel_key(self.m_name, key), value)
+        try:
+            return fn(*args)
+        except PVDisconnectException:
+            self.recorder.write(CONNECT, self.m_name, 0)
+            raise
+
+    def enable_async(self):
+        return self._write('enable_chan', 0, self.motor.enable_async)
+
+    def disable_async(self):
+        return self._write('enable_chan', 1, self.motor.disable_async)
+
+    def set_pos_async(self, pos):
+        return self._write('set_chan', pos, self.motor.set_pos_async, pos)
+
+    def stop_async(self):
+        return self._write('spmg', 'Stop', self.motor.stop_async)
+
+    def enable(self):
+        return self._write('enable_chan', 0, self.motor.enable)
+
+    def disable(self):
+        return self._write('enable_chan', 1, self.motor.disable)
+
+    def set_pos(self, pos):
+        return self._write('set_chan', pos, self.motor.set_pos, pos)
+
+    def stop(self):
+        return self._write('spmg', 'Stop', self.motor.stop)
+
+# Replay motor class
+class ReplayMotor():
+    """ Motor backend that serves recorded traffic from a TrafficPlayer """
+
+    channels = PCUMotor.channels
+    snapshot_channels = PCUMotor.snapshot_channels
+
+    def __init__(self, m_name, player, m_type="ln", base=None):
+        self.m_name = m_name
+        self.player = player
+        self.listeners = []
+        # Nothing is sent to a channel
+        self.ca_calls = CallCounter()
+        base = PCUMotor.base_pattern if base is None else base
+        for channel_key, channel_pat in self.channels.items():
+            setattr(self, channel_key+"_name", f"{base}:{m_type}:{m_name}{channel_pat}")
+
+    @classmethod
+    def factory(cls, player):
+        """ Returns a motor_class for PCUSequencer, replaying from player """
+        return lambda m_name, **kwargs: cls(m_name, player, **kwargs)
+
+    @classmethod
+    def connect_many(cls, motors, **kwargs):
+        return []
+
+    @classmethod
+    def read_many(cls, motors, keys):
+        return {m_name: {key: motor.player.expect(READ, channel_key(m_name, key)) for key in keys}
+                for m_name, motor in motors.items()}
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def check_connection(self):
+        if not self.player.expect(CONNECT, self.m_name):
+            raise PVDisconnectException(f"Channel {self.get_chan_name} has disconnected.")
+
+    @property
+    def position(self):
+        return self.player.expect(MONITOR, channel_key(self.m_name, 'get_chan'))
+
+    @property
+    def move_state(self):
+        return self.player.expect(MONITOR, channel_key(self.m_name, 'moving'))
+
+    def isMoving(self):
+        return bool(self.move_state)
+
+    def _write(self, key, value):
+        """ Checks a write to a channel (key) against the log, returns completed futures """
+        self.player.written(channel_key(self.m_name, key), value)
+        name = getattr(self, key+"_name")
+        if self.player.disconnected(self.m_name):
+            raise PVDisconnectException(f"Channel {name} has disconnected.")
+        future = Future()
+        future.pvname = name
+        future.set_result(name)
+        return [future]
+
+    def enable_async(self): return self._write('enable_chan', 0)
+    def disable_async(self): return self._write('enable_chan', 1)
+    def set_pos_async(self, pos): return self._write('set_chan', pos)
+    def stop_async(self): return self._write('spmg', 'Stop')
+    def enable(self): self._write('enable_chan', 0)
+    def disable(self): self._write('enable_chan', 1)
+    def set_pos(self, pos): self._write('set_chan', pos)
+    def stop(self): self._write('spmg', 'Stop')
+
+# Traffic player class
+class TrafficPlayer():
+    """
+    Replays a traffic log through a new sequencer on a virtual clock,
+    as fast as possible. Every recorded tick and completion engine wake-up
+    is run again in the order they started, with the reads it made served
+    from the log. Writes that differ from the log are collected in
+    divergences; reads that do not follow the log raise ReplayError.
+    Control inputs read by the caller between ticks are skipped.
+    """
+
+    def __init__(self, path):
+        events = read_traffic(path)
+        self.meta = {e.name: e.value for e in events if e.kind == META}
+
+        # Each tick or wake-up, with the events of its thread until the next one
+        self.segments = []
+        current = {}
+        for event in events:
+            if event.kind in [TICK, ADVANCE]:
+                current[event.stream] = deque()
+                self.segments.append((event, current[event.stream]))
+            elif event.stream in current:
+                current[event.stream].append(event)
+
+        self.divergences = []
+        self.current = deque()
+        self.start = None
+        self.sequencer = None
+
+    def build(self, **kwargs):
+        """ Creates the sequencer to replay into. Other arguments go to PCUSequencer. """
+        from clock import VirtualClock
+        from sequencer import PCUSequencer
+
+        start = self.segments[0][0].time if len(self.segments) != 0 else 0
+        self.clock = VirtualClock(start)
+        self.sequencer = PCUSequencer(self.meta.get('prefix', PCUMotor.base_pattern), clock=self.clock,
+                                      motor_class=ReplayMotor.factory(self),
+                                      traffic=self, **kwargs)
+        if self.meta.get('digest') != self.sequencer.compiled.digest:
+            self.sequencer.message("Configuration files differ from the recording.")
+        return self.sequencer
+
+    def attach(self, sequencer):
+        """ Serves the sequencer's control channels from the log """
+        for attr in input_channels(sequencer):
+            setattr(sequencer, attr, TapChannel(getattr(sequencer, attr), attr[1:], self))
+
+    def expect(self, kind, name):
+        """ Returns the value of the next recorded event, which must be kind and name """
+        if len(self.current) == 0:
+            raise ReplayError(f"Replay read {KIND_NAMES[kind]} {name} after the end of the " +
+                              f"recorded {self.describe(self.start)}.")
+        event = self.current[0]
+        if event.kind != kind or event.name != name:
+            raise ReplayError(f"Replay read {KIND_NAMES[kind]} {name}, but the log has " +
+                              f"{KIND_NAMES[event.kind]} {event.name} in {self.describe(self.start)}.")
+        self.current.popleft()
+        return event.value
+
+    def disconnected(self, m_name):
+        """ Checks for a recorded disconnect of m_name right after a write """
+        if len(self.current) != 0 and self.current[0].kind == CONNECT and self.current[0].name == m_name:
+            return not self.current.popleft().value
+        return False
+
+    def written(self, name, value):
+        """ Compares a write with the log """
+        recorded = self.expect(WRITE, name)
+        same = recorded == value
+        if isinstance(recorded, float) and isinstance(value, numbers.Real):
+            same = abs(recorded - value) < 1e-9
+        if not same:
+            self.divergences.append((self.clock.time(), name, recorded, value))
+
+    def input(self, name, value):
+        return self.expect(INPUT, name)
+
+    def tick(self, state):
+        if self.start is not None and self.start.kind == TICK and self.start.name != state:
+            raise ReplayError(f"Replay ticked in {state}, but the log has {self.describe(self.start)}.")
+
+    def describe(self, event):
+        if event is None:
+            return "start"
+        return f"{KIND_NAMES[event.kind]} {event.name} at {event.time:.3f}"
+
+    def run(self):
+        """ Replays every segment in order, returns the number replayed """
+        seq = self.sequencer if self.sequencer is not None else self.build()
+        for i, (start, body) in enumerate(self.segments):
+            self.start = start
+            self.current = body
+            self.clock.advance(max(0, start.time - self.clock.time()))
+            if start.kind == TICK:
+                getattr(seq, f"process_{seq.state.name}")()
+            else:
+                seq.advance_moves()
+            # Inputs read by the caller between ticks are not replayed
+            while len(body) != 0 and body[-1].kind == INPUT:
+                body.pop()
+            if len(body) != 0:
+                raise ReplayError(f"{len(body)} recorded events were not replayed in " +
+                                  f"{self.describe(start)}, next is " +
+                                  f"{KIND_NAMES[body[0].kind]} {body[0].name}.")
+        return len(self.segments)
+
+# -------------------------------------------------------------------------
+# Main function
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Replay a recorded PCU sequencer traffic log.")
+    parser.add_argument("log", help="Traffic log (from 'sequencer.py --record')")
+    args = parser.parse_args()
+
+    player = TrafficPlayer(args.log)
+    seq = player.build()
+    start = time.perf_counter()
+    replayed = player.run()
+    wall = time.perf_counter() - start
+
+    recorded = player.segments[-1][0].time - player.segments[0][0].time if replayed else 0
+    print(f"Replayed {replayed} ticks and wake-ups ({recorded:.1f} s recorded) in {wall:.3f} s.")
+    print(f"Final state: {seq.state.name}")
+    for t, name, old, new in player.divergences:
+        print(f"Divergent write at {t:.3f}: {name} was {old}, now {new}")
@@ -7,32 +7,68 @@
 # - Add an initial position check so motors don't have to be retracted
 
 ### Imports
-from transitions import Machine, State
+import time
+# Start of the imports, for the startup-time breakdown
+_IMPORT_START = time.perf_counter()
+
 from kPySequencer.Sequencer import Sequencer, PVDisconnectException, PVConnectException
 from kPySequencer.Tasks import Tasks
-from kPySequencer.CountdownTimer import CountdownTimer
 import logging, coloredlogs
-import yaml
-import numpy as np
-import time
-from epics import PV
+from epics import ca
 from enum import Enum
 import signal
+import argparse
 import sys
 import os
+import threading
+import functools
 
 import PCU_util as util
-from positions import PCUPos
-from motors import PCUMotor
+from positions import PCUPos, PCUPosArray
+from motors import PCUMotor, gather
+from snapshot import PCUSnapshot
+from completion import CompletionEngine
+from planner import MovePlanner
+from kinematics import PCUKinematics
+from channels import ChangedChannel
+from configs import ConfigMatcher, ConfigError
+from geometry import PCUGeometry
+from tracking import OffsetTracker
+from clock import WallClock, ClockTimer
+from instrumentation import TickStats
+# Pattern requests import patterns when needed
+
+IMPORT_TIME = time.perf_counter() - _IMPORT_START
 
 # Static/global variables
 TIME_DELAY = 0.5 # seconds
 HOME = 0 # mm
 
-MOVE_TIME = 45 # seconds
+MOVE_TIME = 45 # seconds, for motors without a kinematic model
+PUT_TIMEOUT = 5 # seconds, for enables and disables to complete
 CLEARANCE_PMASK = 35 # mm, including mask radius
 CLEARANCE_FIBER = 35 # mm, including fiber radius
 
+# Tick period of each state in adaptive mode (seconds)
+TICKRATES = {
+    'INIT': 0.5,
+    'INPOS': 0.5, # Move requests are picked up by this tick; there is no request wake-up yet
+    'MOVING': 0.02,
+    'FAULT': 1.0,
+    'TERMINATE': 1.0,
+}
+# Smoothing factor for the measured loop period
+PERIOD_SMOOTHING = 0.1
+
+# Deadbands for posting readback channels
+POS_DEADBAND = 1e-4 # mm
+TIME_DEADBAND = 0.05 # seconds
+PERIOD_DEADBAND = 0.001 # seconds
+
+# Methods timed on every tick (see TickStats)
+HOT_PATH = ['checkmeta', 'check_offsets', 'get_mini_moves', 'process_request',
+            'process_pos_request', 'move_complete']
+
 # Undefined value for mini-move channels
 RESET_VAL = -999.9 # mm, theoretically
 
@@ -91,6 +127,17 @@ motor_file = "./motor_configurations.yaml"
 # all_configs = dict(base_configs, **fiber_configs, **mask_configs)
 # user_configs = dict(fiber_configs, **mask_configs)
 
+def locked(handler):
+    """ 
+    Runs a state handler holding move_lock, so the completion engine
+    never sees the snapshot, state or move queue in the middle of a tick
+    """
+    @functools.wraps(handler)
+    def wrapper(self):
+        with self.move_lock:
+            return handler(self)
+    return wrapper
+
 class PCUStates(Enum):
     INIT = 0
     INPOS = 1
@@ -100,20 +147,57 @@ class PCUStates(Enum):
 
 # Class containing state machine
 class PCUSequencer(Sequencer):
-
-    # FIX Z-STAGE
-    home_Z = {'m3':0, 'm4':0}
     
     # -------------------------------------------------------------------------
     # Initialize the sequencer
     # -------------------------------------------------------------------------
-    def __init__(self, prefix="k1:ao:pcu", tickrate=0.5):
+    def __init__(self, prefix="k1:ao:pcu", tickrate=0.5, adaptive=True,
+                 clock=None, motor_class=PCUMotor, telemetry=None, traffic=None):
+        """
+        Initializes the sequencer. clock (WallClock or VirtualClock) and
+        motor_class (called with each motor name) can be replaced for
+        simulation. The completion engine is not started here: call
+        completion.start(), or else call advance_moves from the caller
+        (as the virtual driver does). Snapshots are recorded to telemetry
+        (TelemetryRecorder) if given. traffic (TrafficRecorder or
+        TrafficPlayer, see replay) records or replays the channel traffic.
+        """
+        # Time spent in each startup step (seconds)
+        self.startup = {'imports': IMPORT_TIME}
+        step = time.perf_counter()
+        
         super().__init__(prefix, tickrate=tickrate)
+        self.prefix = prefix
+        # Source of time for moves, dwells, tracking and tick periods
+        self.clock = WallClock() if clock is None else clock
+        self.motor_class = motor_class
+        self.telemetry = telemetry
+        self.traffic = traffic
+        # Use a different tick period for each state
+        self.adaptive = adaptive
+        self.tick_periods = dict(TICKRATES)
+        self.last_tick = None
         
         # Create new channel for metastate
-        self._seqmetastate = self.ioc.registerString(f'{prefix}:stst')
+        # (readback channels only post when their value changes)
+        self._seqmetastate = ChangedChannel(self.ioc.registerString(f'{prefix}:stst'))
         self._pos = self.ioc.registerString(f'{prefix}:pos')
-        self._posRb = self.ioc.registerString(f'{prefix}:posRb')
+        self._posRb = ChangedChannel(self.ioc.registerString(f'{prefix}:posRb'))
+        # Predicted time until the current reconfiguration completes
+        self._moveTimeRb = ChangedChannel(self.ioc.registerDouble(f'{prefix}:moveTimeRb'),
+                                          deadband=TIME_DEADBAND)
+        # Dither/raster patterns: request, dwell per point, progress
+        self._pattern = self.ioc.registerString(f'{prefix}:pattern')
+        self._patternDwell = self.ioc.registerDouble(f'{prefix}:patternDwell', initial_value=0)
+        self._patternPointRb = ChangedChannel(self.ioc.registerDouble(f'{prefix}:patternPointRb'))
+        self._patternLengthRb = ChangedChannel(self.ioc.registerDouble(f'{prefix}:patternLengthRb'))
+        # Offset tracking: enable flag and latest XY offset targets
+        self._track = self.ioc.registerDouble(f'{prefix}:track', initial_value=0)
+        self._m1Track = self.ioc.registerDouble(f'{prefix}:m1Track', initial_value=0)
+        self._m2Track = self.ioc.registerDouble(f'{prefix}:m2Track', initial_value=0)
+        # Measured period of the main loop
+        self._tickPeriodRb = ChangedChannel(self.ioc.registerDouble(f'{prefix}:tickPeriodRb'),
+                                            deadband=PERIOD_DEADBAND)
         
         self.prepare(PCUStates)
         self.destination = ''
@@ -121,38 +205,134 @@ class PCUSequencer(Sequencer):
         self.motor_moves = []
         # Checks whether move has completed
         self.current_move = None
+        # Start time and predicted duration of the current move
+        self.move_start = None
+        self.move_expected = 0
+        # Pattern execution: active flag and end of the current dwell
+        self.pattern_active = False
+        self.dwell_end = 0
+        # Whether the current move follows a tracking target
+        self.tracking_move = False
+        # Motor readbacks for the current tick
+        self.snapshot = None
+        # Guards the move queue, shared with the completion engine
+        self.move_lock = threading.RLock()
+        # Thread that has joined the main thread's CA context
+        self._ca_thread = None
+        
+        step = self.startup_step('ioc', step)
         
         # Load configurations
+        self.compiled = None
         self.load_config_files()
+        step = self.startup_step('configs', step)
         
         # Load motor objects and channels
         self.load_motors(prefix)
+        if self.traffic is not None:
+            self.traffic.attach(self)
+        step = self.startup_step('motors', step)
+        
+        # Connect all motor channels in parallel, with one timeout
+        motor_type = type(next(iter(self.motors.values()), None))
+        if len(self.motors) != 0:
+            missing = motor_type.connect_many(self.motors)
+            if len(missing) != 0:
+                self.critical(f"Channels did not connect: {', '.join(missing)}")
+        step = self.startup_step('connect', step)
         
         # A timer for runtime usage
-        self.move_timer = CountdownTimer()
+        self.move_timer = ClockTimer(self.clock)
+        
+        # Latencies, CA calls and overruns of each tick, published as channels
+        self.stats = TickStats(self.ioc, prefix, HOT_PATH,
+                               counter=lambda: sum(motor.ca_calls.value for motor in self.motors.values()))
+        self.stats.wrap(self)
+        
+        # Triggers queued moves from motor monitors, once started
+        self.completion = CompletionEngine(self)
+        self.startup_step('other', step)
+        
+        # Publish the startup-time breakdown
+        self.startup['total'] = sum(self.startup.values())
+        for name, seconds in self.startup.items():
+            self.ioc.registerDouble(f'{prefix}:startup{name.capitalize()}Rb', initial_value=seconds)
+        self.message("Startup times: " + ', '.join([f'{name} {seconds:.3f} s'
+                                                    for name, seconds in self.startup.items()]))
+    
+    def startup_step(self, name, start):
+        """ Records the time since start as a startup step, returns the current time """
+        now = time.perf_counter()
+        self.startup[name] = now - start
+        return now
     
     def load_config_files(self):
-        """ Loads configuration files into class variables """
-        # Load configuration files
-        self.base_configs, self.fiber_configs, self.mask_configs = util.load_configurations()
-        motor_info = util.load_motors()
+        """ 
+        Loads configuration files into class variables.
+        Returns False if the files have not changed since the last load.
+        Raises ConfigError for invalid files.
+        """
+        # Load compiled configuration files
+        compiled = util.store.load()
+        if compiled is self.compiled:
+            return False
+        self.compiled = compiled
+        
+        self.base_configs = compiled.base_configs
+        self.fiber_configs = compiled.fiber_configs
+        self.mask_configs = compiled.mask_configs
+        motor_info = compiled.motor_info
         
         # Assign motor info to variables
-        self.valid_motors = motor_info['valid_motors']
-        self.motor_limits = motor_info['limits']
-        self.tolerance = motor_info['tolerance']
-        self.fiber_limits = motor_info['fiber_limits']
-        self.mask_limits = motor_info['mask_limits']
+        self.valid_motors = compiled.valid_motors
+        self.tolerance = compiled.tolerance
+        self.fiber_limits = compiled.fiber_limits
+        self.mask_limits = compiled.mask_limits
 
         # Assign config info to variables
-        self.all_configs = dict(self.base_configs, **self.fiber_configs, **self.mask_configs)
-        self.user_configs = dict(self.fiber_configs, **self.mask_configs)
+        self.all_configs = compiled.all_configs
+        self.user_configs = compiled.user_configs
+        
+        # Matches motor positions to named configurations
+        self.matcher = ConfigMatcher.from_compiled(compiled, self.valid_motors, self.tolerance)
+        # Collision model for limits and keep-in regions, used by this sequencer only
+        self.geometry = PCUGeometry.from_compiled(compiled, PCUPos.valid_motors,
+                            clearance={'mask': CLEARANCE_PMASK, 'fiber': CLEARANCE_FIBER})
+        # Predicts move durations and timeouts
+        self.kinematics = PCUKinematics.from_motor_info(motor_info, default_time=MOVE_TIME)
+        # Coalesces and rate-limits tracking targets
+        self.tracker = OffsetTracker(self.tolerance)
+        # Groups motor moves into concurrent stages with safe paths
+        self.planner = MovePlanner(self.valid_motors, self.tolerance, geometry=self.geometry)
+        
+        return True
+    
+    def use_ca_context(self):
+        """ Joins the CA context of the main thread, once for the task thread """
+        if self._ca_thread != threading.get_ident():
+            ca.use_initial_context()
+            self._ca_thread = threading.get_ident()
+    
+    def load_kinematics(self):
+        """ 
+        Loads the motion model from the speeds and accelerations of the
+        motor records, falling back on the motor file for motors that
+        do not report them
+        """
+        motor_type = type(next(iter(self.motors.values())))
+        records = motor_type.read_many(self.motors, ['velo', 'accl'])
+        self.kinematics = PCUKinematics.from_motor_info(self.compiled.motor_info, records=records,
+                                                        default_time=MOVE_TIME)
+        estimated = [m_name for m_name in self.motors if self.kinematics.sources.get(m_name) != 'record']
+        if len(estimated) != 0:
+            self.message(f"Motor records did not report VELO/ACCL for {', '.join(estimated)}; " +
+                         "using the motor file.")
     
     def load_motors(self, prefix):
-        """ Loads valid motors into class variable """
+        """ Loads valid motors (under prefix) into class variable """
         # Initialize epics PVs for motors
         self.motors = {
-            m_name: PCUMotor(m_name) for m_name in self.valid_motors
+            m_name: self.motor_class(m_name, base=prefix) for m_name in self.valid_motors
         }
         
         # Register individual motor channels
@@ -163,16 +343,18 @@ class PCUSequencer(Sequencer):
                 setattr(self, "_"+chan_name, self.ioc.registerDouble(f'{prefix}:{chan_name}', 
                                                                      initial_value=RESET_VAL))
                 self.add_property(chan_name, dest_read=True)
-                # Register IOC channel for readback
-                setattr(self, "_"+chan_name+"Rb", self.ioc.registerDouble(f'{prefix}:{chan_name}Rb'))
+                # Register IOC channel for readback, posted on change
+                rb_channel = self.ioc.registerDouble(f'{prefix}:{chan_name}Rb')
+                setattr(self, "_"+chan_name+"Rb", ChangedChannel(rb_channel, deadband=POS_DEADBAND))
                 self.add_property(chan_name+"Rb")
     
     def user_configs_valid(self):
         """ Checks that the user-defined configurations are valid """
-        # Check user-defined positions
-        for c_name, pos in self.user_configs.items():
-            config = PCUPos(pos)
-            if not config.is_valid():
+        # Check all user-defined positions at once
+        configs = PCUPosArray.from_dicts(self.user_configs.values())
+        valid = self.geometry.is_valid(configs)
+        for c_name, c_valid in zip(self.user_configs, valid):
+            if not c_valid:
                 # What to do if it's not valid?
                 self.critical(f"Configuration {c_name} is invalid. " +
                               "Please check the motor and instrument limits before reinitializing.")
@@ -181,33 +363,26 @@ class PCUSequencer(Sequencer):
     
     def get_config(self):
         """ Gets the initial configuration of the PCU """
-        # Loop through configurations
-        for config, values in self.all_configs.items():
-            all_match = True
-            
-            # Loop through motors
-            for m_name in self.valid_motors:
-                if not self.motor_in_position(m_name, values[m_name]):
-                    all_match = False
-                    break
-            
-            # Found a match for motor positions
-            if all_match:
-                return config
-            
-            # Pinhole mask config with offset
-            if (self.pmask_extended() and 
-                (not self.fiber_extended()) and 
-                self.element_in_hole('pmask')):
-                return 'pinhole_mask'
-            
-            # Fiber bundle config with offset
-            if (self.fiber_extended() and
-                (not self.pmask_extended()) and
-                self.element_in_hole('fiber')):
-                return 'fiber_bundle'
-            
-            return None
+        # Compare positions to all configurations at once
+        config = self.matcher.match(self.get_positions())
+        
+        # Found a match for motor positions
+        if config is not None:
+            return config
+        
+        # Pinhole mask config with offset
+        if (self.pmask_extended() and 
+            (not self.fiber_extended()) and 
+            self.element_in_hole('pmask')):
+            return 'pinhole_mask'
+        
+        # Fiber bundle config with offset
+        if (self.fiber_extended() and
+            (not self.pmask_extended()) and
+            self.element_in_hole('fiber')):
+            return 'fiber_bundle'
+        
+        return None
     
     # -------------------------------------------------------------------------
     # Motor-specific functions
@@ -233,30 +408,17 @@ class PCUSequencer(Sequencer):
         if dest_pos is not None: return dest_pos['m4'] > 0
         else: return not self.motor_in_position('m4', 0)
     
-    def pmask_center(self):
-        return self.base_configs['pinhole_mask']['m1'], self.base_configs['pinhole_mask']['m2']
-    
-    def fiber_center(self):
-        return self.base_configs['fiber_bundle']['m1'], self.base_configs['fiber_bundle']['m2']
-    
     def element_in_hole(self, element, dest_pos=None):
         """ Checks whether pmask or fiber is in the K-mirror rotator hole """
-        # Get center and radius of configuration
+        # Geometry names the pinhole mask 'mask'
         if element=='pmask':
-            xc, yc = self.pmask_center()
-            radius = CLEARANCE_PMASK
-        elif element=='fiber':
-            xc, yc = self.fiber_center()
-            radius = CLEARANCE_FIBER
+            element = 'mask'
         
         # Check current or future position
         if dest_pos is None: # Current positions
-            x_pos, y_pos = self.motors['m1'].get_pos(), self.motors['m2'].get_pos()
-        else: # Future positions
-            x_pos, y_pos = dest_pos['m1'], dest_pos['m2']
-        
-        return (xc - x_pos)**2 + (yc - y_pos)**2 < radius
+            dest_pos = self.get_positions()
         
+        return bool(self.geometry.in_hole(element, dest_pos)[0])
     
     # -------------------------------------------------------------------------
     # Mini-move functions
@@ -323,130 +485,250 @@ class PCUSequencer(Sequencer):
         for m_name, m_dest in mini_moves.items():
             dest_pos[m_name] = m_dest
         
-        if not self.check_motor_limits(dest_pos):
-            return False
-        
-        # Get centers of XY coordinates
-        xc = self.all_configs[self.configuration]['m1']
-        yc = self.all_configs[self.configuration]['m2']
-        x_dest = dest_pos['m1']
-        y_dest = dest_pos['m2']
-        
         # Check for pinhole mask moves
         if self.configuration == "pinhole_mask":
-            r_circ = CLEARANCE_PMASK # mm ### what do we want the clearance to be?
-            # I'm going to need the exact center of the circle we want for this
-            # The values we're using now are just estimates
-            
+            element = 'pmask'
             # OK to move pinhole mask, not fiber bundle
-            # Maybe this should raise an error? Can you attach a string to a 
-            #     low-level error and print out a warning higher up?
-            if m_name == 'm3': return True
-            if m_name == 'm4': return False
-            
-            # Check if XY motors are outside circle bounds
-            return (x_dest-xc)**2 + (y_dest-yc)**2 < r_circ**2
+            if 'm4' in mini_moves: return False
         
         elif self.configuration == "fiber_bundle": # Check for fiber bundle moves
-            r_circ = CLEARANCE_FIBER # mm
+            element = 'fiber'
             # OK to move fiber bundle, not pinhole mask
-            if m_name == 'm3': return False
-            if m_name == 'm4': return True
-            
-            # Check if XY motors are outside circle bounds
-            self.message(f"{xc}, {x_dest}, {yc}, {y_dest}, {r_circ}")
-            return (xc-x_dest)**2 + (yc-y_dest)**2 < r_circ**2
+            if 'm3' in mini_moves: return False
             
         else: # This shouldn't happen
             self.critical("Reached impossible state in checking mini-moves.")
             self.to_FAULT()
+            return False
+        
+        # Check limits and collisions, that XY stays in the rotator hole,
+        # and that the path there is clear
+        return (bool(self.geometry.is_valid(dest_pos)[0]) and
+                self.element_in_hole(element, dest_pos) and
+                self.geometry.path_valid(self.get_positions(), dest_pos))
+    
+    # -------------------------------------------------------------------------
+    # Pattern functions
+    # -------------------------------------------------------------------------
+    
+    def load_pattern(self, offsets):
+        """ 
+        Loads XY offsets (N x 2) from the current configuration into the move queue,
+        after checking every point and every step between points in one pass
+        """
+        if self.configuration not in ['pinhole_mask', 'fiber_bundle']:
+            self.critical("Patterns are only allowed in the pinhole_mask and fiber_bundle configurations.")
+            return False
+        if not ('m1' in self.valid_motors and 'm2' in self.valid_motors):
+            self.critical("X and Y motors must be enabled for patterns to take place.")
+            return False
+        
+        # Absolute positions: current Z, configuration XY plus offsets
+        center = self.all_configs[self.configuration]
+        current = PCUPos(self.get_positions(), geometry=self.geometry)
+        points = PCUPosArray.from_positions([current] * (len(offsets)+1))
+        points.column('m1')[1:] = center['m1'] + offsets[:, 0]
+        points.column('m2')[1:] = center['m2'] + offsets[:, 1]
+        
+        # All points and steps (starting from here) must stay in the hole
+        element = 'mask' if self.configuration == 'pinhole_mask' else 'fiber'
+        if not (self.geometry.xy_steps_valid(points) and
+                all(self.geometry.in_hole(element, points))):
+            self.critical(f"Pattern leaves the rotator hole for configuration {self.configuration}.")
+            return False
+        
+        # Load points into queue
+        self.motor_moves.clear()
+        for x, y in zip(points.column('m1')[1:], points.column('m2')[1:]):
+            self.motor_moves.append({'m1': float(x), 'm2': float(y)})
+        
+        self.pattern_active = True
+        self.dwell_end = 0
+        self.pattern_point = 0
+        self.pattern_length = len(offsets)
+        # Set destination to preserve configuration
+        self.destination = self.configuration
+        return True
+    
+    def process_pattern_request(self):
+        """ Processes a request for a dither/raster pattern """
+        request = self.pattern_request
+        if request in [None, '']:
+            return
+        
+        if self.state == PCUStates.INPOS:
+            try:
+                import patterns
+                offsets = patterns.parse_pattern(request)
+            except ValueError as err:
+                self.critical(f"Invalid pattern '{request}': {err}")
+                return
+            if self.load_pattern(offsets):
+                self.message(f"Starting pattern of {len(offsets)} points.")
+                self.to_MOVING()
+        elif self.state == PCUStates.MOVING:
+            self.critical("Send stop signal before starting a pattern.")
+        elif self.state == PCUStates.FAULT:
+            self.critical("Reinitialize the PCU sequencer before moving.")
+    
+    def point_reached(self):
+        """ Counts a reached pattern point and starts its dwell """
+        self.pattern_point += 1
+        dwell = self.pattern_dwell or 0
+        self.dwell_end = self.clock.time() + dwell
+        # Don't time out while dwelling
+        self.move_timer.start(seconds=self.kinematics.timeout(dwell))
+    
+    def dwell_done(self):
+        """ Checks whether the dwell at the last pattern point is over """
+        return not self.pattern_active or self.clock.time() >= self.dwell_end
+    
+    # -------------------------------------------------------------------------
+    # Tracking functions
+    # -------------------------------------------------------------------------
+    
+    def process_tracking(self):
+        """ 
+        Follows the m1Track/m2Track offsets while tracking is enabled.
+        Only the newest target is kept, and the motors are retargeted
+        mid-move (at most once per TRACK_INTERVAL) if it is safe.
+        """
+        if not self.tracking:
+            self.tracker.reset()
+            return
+        
+        # Only track around a configuration with an element in the hole
+        config = self.configuration if self.state == PCUStates.INPOS else self.destination
+        if config not in ['pinhole_mask', 'fiber_bundle']:
+            return
+        # Don't interrupt reconfigurations or patterns
+        if self.state == PCUStates.MOVING and not self.tracking_move:
+            return
+        if not ('m1' in self.valid_motors and 'm2' in self.valid_motors):
+            return
+        
+        # Latest target wins
+        center = self.all_configs[config]
+        self.tracker.update({'m1': center['m1'] + self.m1Track,
+                             'm2': center['m2'] + self.m2Track})
+        now = self.clock.time()
+        target = self.tracker.due(now)
+        if target is None:
+            return
+        
+        # Target and the step from where the motors are now must stay in the hole
+        element = 'mask' if config == 'pinhole_mask' else 'fiber'
+        if not self.geometry.retarget_valid(element, self.get_positions(), target):
+            self.critical(f"Ignoring unsafe tracking target {target}.")
+            # Don't warn again for the same target
+            self.tracker.sent_target(target, now)
+            return
+        
+        # Retarget the motors
+        with self.move_lock:
+            if not self.trigger_move(target):
+                return
+            self.tracking_move = True
+        self.tracker.sent_target(target, now)
+        
+        if self.state == PCUStates.INPOS:
+            # Set destination to preserve configuration
+            self.destination = self.configuration
+            self.to_MOVING()
     
     # -------------------------------------------------------------------------
     # Regular motor-moving functions
     # -------------------------------------------------------------------------
     
     def enable_all(self):
-        """ Enables all motors in the PCU """
-        for m_name, motor in self.motors.items():
-            motor.enable()
+        """ Enables all motors in the PCU at once """
+        futures = [f for motor in self.motors.values() for f in motor.enable_async()]
+        self.wait_puts(futures)
     
     def disable_all(self):
-        for m_name, motor in self.motors.items():
-            motor.disable()
+        """ Disables all motors in the PCU at once """
+        futures = [f for motor in self.motors.values() for f in motor.disable_async()]
+        self.wait_puts(futures)
+    
+    def wait_puts(self, futures, timeout=PUT_TIMEOUT):
+        """ Waits for puts to complete together, reports any that did not """
+        for future in gather(futures, timeout):
+            self.critical(f"Write to {future.pvname} did not complete.")
+    
+    def take_snapshot(self):
+        """ Reads all motor channels once for the current tick """
+        self.snapshot = PCUSnapshot.capture(self.motors, timestamp=self.clock.time())
+        if self.telemetry is not None:
+            self.telemetry.record(self.snapshot.timestamp, self.state.value, self.snapshot)
+        return self.snapshot
+    
+    def motors_moving(self):
+        """ Checks whether any motor was moving in the latest snapshot """
+        if self.snapshot is None:
+            return False
+        return any(self.snapshot.is_moving(m_name) for m_name in self.motors if m_name in self.snapshot)
     
     def get_positions(self):
-        """ Returns positions of all valid motors """
-        all_positions = {}
-        for m_name, motor in self.motors.items():
-            all_positions[m_name] = motor.get_pos()
-        
-        return all_positions
+        """ Returns positions of all valid motors (from this tick's snapshot) """
+        return self.snapshot.positions()
     
     def load_config(self, destination):
-        """ Loads destination's moves into queue, clears current configuration """
-        # Get ordered moves from destination state
-        motor_posvals = self.all_configs[destination]
+        """ 
+        Loads destination's moves into queue, clears current configuration.
+        Returns False without loading if a planned stage has an unsafe path.
+        """
+        # Get current and destination positions
+        current = PCUPos(self.get_positions(), geometry=self.geometry)
+        dest_pos = PCUPos(self.all_configs[destination], name=destination, geometry=self.geometry)
         
-        # Append info to move list
-        self.motor_moves.clear()
+        # Z stages are pulled back unless the move stays in the rotator hole
+        stages = self.planner.plan(current, dest_pos)
+        bad_stage = self.planner.check(current, stages)
+        if bad_stage is not None:
+            self.critical(f"Move {stages[bad_stage]} to {destination} would leave the " +
+                          "rotator hole. Check the current position before moving.")
+            return False
+        if current.move_in_hole(dest_pos) and len(stages) == 1:
+            self.message(f"Moving to {destination} without retracting Z stages.")
         
-        # Pull back Z stages if it's a major move
-        if self.configuration != destination:
-            self.motor_moves.append(PCUSequencer.home_Z)
-        # Note: this should make it so moves within a configuration 
-        #       don't pull the Z stages back all the way
-
-        for m_name in motor_posvals.keys():
-            # Skip bad entries in the yaml file.
-            if m_name not in self.valid_motors:
-                continue
-
-            # Get destination of each motor
-            dest = motor_posvals[m_name]
-
-            # Append to motor moves
-            self.motor_moves.append({m_name:dest})
+        # Append staged moves to move list
+        self.motor_moves.clear()
+        self.motor_moves.extend(stages)
         
         # Clear configuration and set destination
         self.configuration = ''
         self.destination = destination
 
-        return
+        return True
     
     def trigger_move(self, m_dict):
-        """ Triggers move and sets a timer to check if complete """
+        """ 
+        Triggers move and sets a timer to check if complete.
+        Returns False, after faulting, if a motor is not enabled.
+        """
+        # Check that all motors are enabled before moving any of them
+        for m_name in m_dict:
+            if m_name in self.valid_motors and not self.snapshot.is_enabled(m_name):
+                self.critical(f"Motor {m_name} is not enabled.")
+                self.stop_motors()
+                self.move_timer.stop()
+                self.to_FAULT()
+                return False
+        
         for m_name, m_dest in m_dict.items():
             if m_name in self.valid_motors:
-                # Get PV object for motor
-                motor = self.motors[m_name]
-                
-                # Check that the motor is enabled
-                if not motor.isEnabled():
-                    self.critical(f"Motor {m_name} is not enabled.")
-                    self.stop_motors()
-                    self.to_FAULT()
-                
-                # Set position of motor
-                motor.set_pos(m_dest)
+                # Set position of motor, without waiting,
+                # so all axes start together
+                self.motors[m_name].set_pos_async(m_dest)
         
         # Save current move to class variables
         self.current_move = m_dict
         
-        # Start a timer for the move
-        self.move_timer.start(seconds=MOVE_TIME)
+        # Start a timer for the move, scaled to its expected duration
+        self.move_expected = self.kinematics.move_time(self.get_positions(), m_dict)
+        self.move_start = self.clock.time()
+        self.move_timer.start(seconds=self.kinematics.timeout(self.move_expected))
 
-        return
-    
-    def check_motor_limits(self, dest_pos):
-        """ Get motor destinations and check limits """
-        
-        for m_name, m_lim in self.motor_limits.items():
-            if m_name not in dest_pos: continue
-            m_dest = dest_pos[m_name]
-            if m_dest < m_lim[0] or m_dest > m_lim[1]:
-                self.message(f"Limit detected for {m_name}")
-                return False
-        
         return True
     
     def motor_in_position(self, m_name, m_dest):
@@ -455,10 +737,8 @@ class PCUSequencer(Sequencer):
         if m_name not in self.valid_motors:
             return False
         
-        # Get PV getter for motor
-        motor = self.motors[m_name]
-        # Get current position
-        cur_pos = motor.get_pos()
+        # Get current position from this tick's snapshot
+        cur_pos = self.snapshot.position(m_name)
         
         # Compare to destination within tolerance, return False if not reached
         t = self.tolerance[m_name]
@@ -483,8 +763,55 @@ class PCUSequencer(Sequencer):
         # Return True if motors are in position and release current_move
         self.message(f"Move {self.current_move} complete!")
         self.current_move = None
+        if self.pattern_active:
+            self.point_reached()
+        return True
+    
+    def move_settled(self, m_dict):
+        """ Checks a move against the latest monitor values (no CA reads) """
+        for m_name, m_dest in m_dict.items():
+            if m_name not in self.valid_motors:
+                continue
+            motor = self.motors[m_name]
+            # Motor must be stopped and within tolerance
+            if motor.position is None or motor.isMoving():
+                return False
+            if abs(motor.position - m_dest) >= self.tolerance[m_name]:
+                return False
+        
         return True
     
+    def advance_moves(self):
+        """ 
+        Triggers the next queued move as soon as the current one settles.
+        Called by the completion engine; the first move, the end of the queue,
+        and faults are left to process_MOVING.
+        """
+        with self.move_lock:
+            if self.state != PCUStates.MOVING:
+                return
+            if self.current_move is None or len(self.motor_moves) == 0:
+                return
+            if not self.move_settled(self.current_move):
+                return
+            
+            # Leave disabled motors for the tick to fault on
+            next_move = self.motor_moves[0]
+            for m_name in next_move:
+                if m_name in self.valid_motors and not self.snapshot.is_enabled(m_name):
+                    return
+            
+            self.message(f"Move {self.current_move} complete!")
+            # Pattern points dwell first; the tick triggers the next one
+            if self.pattern_active:
+                self.current_move = None
+                self.point_reached()
+                if not self.dwell_done():
+                    return
+            self.motor_moves.pop(0)
+            self.message(f"Triggering move, {next_move}.")
+            self.trigger_move(next_move)
+    
     def stop_motors(self):
         """ Stops motors only """
         
@@ -492,23 +819,35 @@ class PCUSequencer(Sequencer):
         self.critical("Stopping all motors.")
         
         # Clear future moves from queue
-        self.current_move = None
-        self.motor_moves.clear()
+        with self.move_lock:
+            self.current_move = None
+            self.motor_moves.clear()
+            self.pattern_active = False
+            self.tracking_move = False
         # Set config to unknown
         self.configuration = ''
         self.destination = ''
         
-        # Stop motors
-        for _, pv in self.motors.items():
-            pv.stop()
+        # Stop all motors at once, without waiting for completion
+        for motor in self.motors.values():
+            motor.stop_async()
     
     def stop(self):
         """ Stops all PCU motors and halts operation """
         # Stop motors
         self.stop_motors()
+        self.shutdown()
+    
+    def shutdown(self):
+        """ Halts operation without stopping the motors """
+        self.completion.stop()
+        if self.telemetry is not None:
+            self.telemetry.flush()
         
         # Call the superclass stop method
         super().stop()
+        if self.traffic is not None:
+            self.traffic.close()
     
     def home_motors(self):
         """ Homes the motors (z-stages first, then X and Y) """
@@ -523,7 +862,7 @@ class PCUSequencer(Sequencer):
     def process_request(self):
         """ Processes input from the request keyword """
         # Check the request keyword
-        request = self.seqrequest.lower()
+        request = self.read_input('seqrequest', self.seqrequest).lower()
 
         if request == '':
             return
@@ -531,7 +870,7 @@ class PCUSequencer(Sequencer):
         if request == 'shutdown':
             if self.state != PCUStates.MOVING:
                 self.message("Shutting down sequencer.")
-                super().stop()
+                self.shutdown()
             else:
                 self.critical("Aborting sequencer.")
                 self.stop()
@@ -578,9 +917,9 @@ class PCUSequencer(Sequencer):
             if destination in self.all_configs:
                 self.message(f"Loading {destination} state.")
                 # Load next configuration (sets self.destination)
-                self.load_config(destination)
-                # Start move
-                self.to_MOVING()
+                if self.load_config(destination):
+                    # Start move
+                    self.to_MOVING()
             else: self.critical(f'Invalid configuration: {destination}')
             ### Request from MOVING
         elif self.state == PCUStates.MOVING:
@@ -589,9 +928,15 @@ class PCUSequencer(Sequencer):
         elif self.state == PCUStates.FAULT:
             self.critical("Reinitialize the PCU sequencer before moving.")
     
+    def read_input(self, name, value):
+        """ Passes a control input (value) through the traffic recorder or player, if any """
+        if self.traffic is None:
+            return value
+        return self.traffic.input(name, value)
+    
     def checkabort(self):
         """Check if the abort flag is set, and drop into the FAULT state"""
-        if self.seqabort:
+        if self.read_input('seqabort', self.seqabort):
             self.critical('Aborting sequencer!')
             self.stop()
 
@@ -607,6 +952,62 @@ class PCUSequencer(Sequencer):
         if self.state==PCUStates.INPOS and self.configuration=='':
             self.configuration = 'user_def'
     
+    def check_move_time(self):
+        """ Publishes the predicted time until all queued moves are complete """
+        if self.state != PCUStates.MOVING:
+            self.move_time = 0
+            return
+        
+        with self.move_lock:
+            # Time left on the current move
+            remaining = 0
+            pos = self.get_positions()
+            if self.current_move is not None:
+                elapsed = self.clock.time() - self.move_start
+                remaining = max(0, self.move_expected - elapsed)
+                pos.update({m: v for m, v in self.current_move.items() if m in pos})
+            # Queued moves start where the current move ends
+            remaining += self.kinematics.queue_time(pos, self.motor_moves)
+            # Pattern points dwell after every move
+            if self.pattern_active:
+                remaining += max(0, self.dwell_end - self.clock.time())
+                remaining += (self.pattern_dwell or 0) * (len(self.motor_moves) + 
+                                                          (self.current_move is not None))
+        
+        self.move_time = remaining
+    
+    def begin_tick(self):
+        """ Marks the start of a tick, for the tick statistics and traffic log """
+        self.stats.begin_tick()
+        if self.traffic is not None:
+            self.traffic.tick(self.state.name)
+    
+    def update_tickrate(self):
+        """ Measures the loop period and sets the tick period for the current state """
+        # Tick overran if it took longer than its period
+        self.stats.end_tick(self.tickrate)
+        now = self.clock.time()
+        if self.last_tick is not None:
+            # Smoothed loop period
+            period = now - self.last_tick
+            last = self.tick_period
+            if last:
+                period = last + PERIOD_SMOOTHING*(period - last)
+            self.tick_period = period
+        self.last_tick = now
+        
+        if self.adaptive:
+            # Tracking needs the fast loop even when in position
+            if self.tracking and self.state == PCUStates.INPOS:
+                self.tickrate = self.tick_periods['MOVING']
+            # Motors still stopping after a fault are sampled at the moving rate
+            elif self.state == PCUStates.FAULT and self.motors_moving():
+                self.tickrate = self.tick_periods['MOVING']
+            else:
+                self.tickrate = self.tick_periods.get(self.state.name, self.tickrate)
+        
+        self.stats.publish(now)
+    
     def check_offsets(self):
         """ Checks offsets from the current configuration """
         if self.configuration not in self.all_configs: # No metastate
@@ -637,6 +1038,53 @@ class PCUSequencer(Sequencer):
             self._pos.set(''.encode('UTF-8'))
         return request
     
+    @property
+    def move_time(self):
+        return self._moveTimeRb.get()
+    @move_time.setter
+    def move_time(self, val): self._moveTimeRb.set(val)
+    
+    @property
+    def tick_period(self):
+        return self._tickPeriodRb.get()
+    @tick_period.setter
+    def tick_period(self, val): self._tickPeriodRb.set(val)
+    
+    @property
+    def pattern_request(self):
+        request = self._pattern.get()
+        if request not in [None, '']:
+            self._pattern.set(''.encode('UTF-8'))
+        return request
+    
+    @property
+    def pattern_dwell(self):
+        return self._patternDwell.get()
+    
+    @property
+    def pattern_point(self):
+        return self._patternPointRb.get()
+    @pattern_point.setter
+    def pattern_point(self, val): self._patternPointRb.set(val)
+    
+    @property
+    def pattern_length(self):
+        return self._patternLengthRb.get()
+    @pattern_length.setter
+    def pattern_length(self, val): self._patternLengthRb.set(val)
+    
+    @property
+    def tracking(self):
+        return bool(self._track.get())
+    
+    @property
+    def m1Track(self):
+        return self._m1Track.get() or 0
+    
+    @property
+    def m2Track(self):
+        return self._m2Track.get() or 0
+    
     @property
     def configuration(self):
         cur_pos = self._posRb.get()
@@ -650,17 +1098,23 @@ class PCUSequencer(Sequencer):
     # Init state
     # -------------------------------------------------------------------------
     
+    @locked
     def process_INIT(self):
         ###################################
         ## Any initialization stuff here ##
         ###################################
+        self.begin_tick()
+        self.use_ca_context()
         
         try:
             # Load and check config files
             self.load_config_files()
+            self.load_kinematics()
             if not self.user_configs_valid():
                 self.to_FAULT()
                 return
+            # Read motor positions once for the configuration check
+            self.take_snapshot()
             # Will return configuration or None
             self.configuration = self.get_config()
             
@@ -672,6 +1126,14 @@ class PCUSequencer(Sequencer):
             self.stop_motors()
             self.to_FAULT()
         
+        # Enter the fault state if the configuration files are invalid
+        except ConfigError as err:
+            self.critical(f"{err} Please fix the configuration files before reinitializing.")
+            self.to_FAULT()
+        
+        # Tick period for the next state
+        self.update_tickrate()
+        
         # Home / initialize stages
         # Re-read the config files
         # Make XYZ moves possible
@@ -681,14 +1143,20 @@ class PCUSequencer(Sequencer):
     # INPOS state
     # -------------------------------------------------------------------------
     
+    @locked
     def process_INPOS(self):
         """ Processes the INPOS state """
         ######### Add mini-moves here ##########
+        self.begin_tick()
         self.checkabort()
         self.checkmeta()
-        self.check_offsets()
         
         try:
+            # Read all motor channels once for this tick
+            self.take_snapshot()
+            self.check_offsets()
+            self.check_move_time()
+            
             # Check for mini-moves (dithers)
             mini_moves = self.get_mini_moves()
             # Found mini-moves
@@ -706,24 +1174,34 @@ class PCUSequencer(Sequencer):
             
             self.process_request()
             self.process_pos_request()
+            self.process_pattern_request()
+            self.process_tracking()
 
         # Enter the faulted state if a channel is disconnected while running
         except PVDisconnectException as err:
             self.critical(str(err))
             self.stop_motors()
             self.to_FAULT()
+        
+        # Tick period for the next state
+        self.update_tickrate()
     
     # -------------------------------------------------------------------------
     # MOVING state
     # -------------------------------------------------------------------------
     
+    @locked
     def process_MOVING(self):
         """ Process the MOVING state """
+        self.begin_tick()
         self.checkabort()
         self.checkmeta()
-        self.check_offsets()
         
         try:
+            # Read all motor channels once for this tick
+            self.take_snapshot()
+            self.check_offsets()
+            self.check_move_time()
             
             # Check for mini-move keywords
             mini_moves = self.get_mini_moves()
@@ -734,26 +1212,36 @@ class PCUSequencer(Sequencer):
             # start the reconfig process, if necessary
             self.process_request()
             self.process_pos_request()
+            self.process_pattern_request()
+            self.process_tracking()
             
-            # If there are moves in the queue and previous moves are done
-            if len(self.motor_moves) != 0 and self.move_complete():
-                # There are moves in the queue, pop next move from the list and trigger it
-                next_move = self.motor_moves.pop(0)
-                self.message(f"Triggering move, {next_move}.")
-                self.trigger_move(next_move)
-            elif len(self.motor_moves) == 0 and self.move_complete():
-                # No moves left to make, finish and change state
-                self.message("Finished moving.")
-                # Change configuration and destination keywords
-                self.configuration = self.destination
-                self.destination = ''
-                # Move to in-position state
-                self.to_INPOS()
-            else: # Move is in progress
-                pass
+            # The completion engine may have already
+            # triggered the next move since the last tick
+            with self.move_lock:
+                if self.state != PCUStates.MOVING:
+                    # A request or tracking target has faulted this tick
+                    pass
+                # If there are moves in the queue and previous moves are done
+                elif len(self.motor_moves) != 0 and self.move_complete() and self.dwell_done():
+                    # There are moves in the queue, pop next move from the list and trigger it
+                    next_move = self.motor_moves.pop(0)
+                    self.message(f"Triggering move, {next_move}.")
+                    self.trigger_move(next_move)
+                elif len(self.motor_moves) == 0 and self.move_complete() and self.dwell_done():
+                    # No moves left to make, finish and change state
+                    self.message("Finished moving.")
+                    self.pattern_active = False
+                    self.tracking_move = False
+                    # Change configuration and destination keywords
+                    self.configuration = self.destination
+                    self.destination = ''
+                    # Move to in-position state
+                    self.to_INPOS()
+                else: # Move is in progress
+                    pass
             
             # Check if move has timed out
-            if self.move_timer.expired:
+            if self.state == PCUStates.MOVING and self.move_timer.expired:
                 self.critical("Move failed due to motor timeout.")
                 self.stop_motors()
                 self.to_FAULT()
@@ -763,20 +1251,35 @@ class PCUSequencer(Sequencer):
             self.critical(str(err))
             self.stop_motors()
             self.to_FAULT()
+        
+        # Tick period for the next state
+        self.update_tickrate()
     
     # -------------------------------------------------------------------------
     # FAULT state
     # -------------------------------------------------------------------------
     
+    @locked
     def process_FAULT(self):
         """ Processes the FAULT state """
+        self.begin_tick()
         self.checkabort()
         self.checkmeta()
         
+        # Keep reading the motors, so requests start from where they are
+        # and telemetry records them stopping after the fault
+        try:
+            self.take_snapshot()
+        except PVDisconnectException:
+            pass
+        
         # Respond to request channel
         self.process_request()
         self.process_pos_request()
+        self.process_pattern_request()
         
+        # Tick period for the next state
+        self.update_tickrate()
     
     # -------------------------------------------------------------------------
     # TERMINATE state
@@ -794,16 +1297,48 @@ if __name__ == "__main__":
         'localhost:8603 localhost:8604 localhost:8605 localhost:8606 localhost:5064'
     os.environ['EPICS_CA_AUTO_ADDR_LIST'] = 'NO'
 
-    # Define an enum of task names
-    class TASKS(Enum):
-        SequencerTask1 = 0
+    parser = argparse.ArgumentParser(description="Run PCU sequencers, one per prefix, in one process.")
+    parser.add_argument("prefixes", nargs='*', default=['k1:ao:pcu'],
+                        help="Channel prefix of each PCU (e.g. k1:ao:pcu k2:ao:pcu)")
+    parser.add_argument("--isolate", action='store_true',
+                        help="Keep motor I/O off the state machine thread (see motor_io)")
+    parser.add_argument("--telemetry", metavar="DIR",
+                        help="Record motor telemetry to <DIR>/<prefix>.tlm (see telemetry)")
+    parser.add_argument("--telemetry-interval", type=float, default=0.1,
+                        help="Shortest time between telemetry samples (s)")
+    parser.add_argument("--record", metavar="DIR",
+                        help="Record channel traffic to <DIR>/<prefix>.trf, for replay (see replay)")
+    args = parser.parse_args()
+    
+    motor_class = PCUMotor
+    if args.isolate:
+        from motor_io import IsolatedMotor
+        motor_class = IsolatedMotor
+
+    # Define an enum of task names, one per PCU
+    TASKS = Enum('TASKS', {f'SequencerTask{i+1}': i for i in range(len(args.prefixes))})
 
-    # The main sequencer
-    setup = PCUSequencer(prefix='k1:ao:pcu')
+    # The sequencers share the CA context and the configuration store
+    setups = []
+    for prefix in args.prefixes:
+        recorder = None
+        if args.telemetry:
+            from telemetry import TelemetryRecorder
+            recorder = TelemetryRecorder(os.path.join(args.telemetry, f'{prefix}.tlm'),
+                                         util.valid_motors, interval=args.telemetry_interval)
+        traffic = None
+        if args.record:
+            from replay import TrafficRecorder
+            traffic = TrafficRecorder(os.path.join(args.record, f'{prefix}.trf'))
+        setups.append(PCUSequencer(prefix=prefix, motor_class=motor_class, telemetry=recorder,
+                                   traffic=traffic))
 
     # Create a task pool and register the sequencers that need to run
-    tasks = Tasks(TASKS, 'k1:ao:pcu', workers=len(TASKS))
-    tasks.register(setup, TASKS.SequencerTask1)
+    tasks = Tasks(TASKS, args.prefixes[0], workers=len(TASKS))
+    for setup, task in zip(setups, TASKS):
+        tasks.register(setup, task)
+        # Trigger queued moves as soon as motor monitors report them settled
+        setup.completion.start()
 
     # Start everything
     log.info('Starting sequencer.')
@@ -0,0 +1,210 @@
+### simIOC.py : A soft IOC serving simulated PCU motors, for running the sequencer offline
+### Date : 10/17/26
+
+import argparse
+import logging, coloredlogs
+import os
+import time
+
+### Logging
+coloredlogs.DEFAULT_LOG_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+coloredlogs.DEFAULT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+coloredlogs.install(level='DEBUG')
+log = logging.getLogger('')
+
+### Set port number (before the IOC is created)
+port = '8600'
+log.info(f'Setting server port to {port}')
+os.environ['EPICS_CA_SERVER_PORT'] = port
+
+### Imports
+from kPySequencer.Sequencer import Sequencer
+from kPySequencer.Tasks import Tasks
+from enum import Enum
+
+import PCU_util as util
+from motors import PCUMotor
+from simulation import sim_motors
+
+# Channels written by clients, and their idle values
+INPUT_CHANNELS = {
+    'set_chan': None,
+    'go_chan': 0,
+    'halt_chan': 0,
+    'home_chan': 0,
+    'jog_chan': 0,
+    'enable_chan': None,
+    'torque_chan': None,
+    'spmg': 'Go',
+}
+# Channels published from the simulation
+OUTPUT_CHANNELS = ['get_chan', 'moving', 'enableRb', 'torqueRb']
+# Motor record fields that never change, published once at startup
+CONSTANT_CHANNELS = ['velo', 'accl']
+
+class simStates(Enum):
+    INIT = 0
+    RUNNING = 1
+    TERMINATE = 2
+
+# Class serving simulated motors
+class simSequencer(Sequencer):
+
+    # -------------------------------------------------------------------------
+    # Initialize the sequencer
+    # -------------------------------------------------------------------------
+    def __init__(self, prefix="k1:ao:pcu:sim", base="k1:ao:pcu", start='telescope',
+                 noise=0, tickrate=0.01):
+        super().__init__(prefix, tickrate=tickrate)
+
+        # Fault injection: '<motor> <fault>', '<motor> clear' or 'clear'
+        self._fault = self.ioc.registerString(f'{prefix}:fault')
+
+        # Simulated motors, starting at a named configuration
+        configs = dict(util.base_configs, **util.fiber_configs, **util.mask_configs)
+        self.sims = sim_motors(util.motor_info, configs[start], noise=noise)
+
+        # Serve every PCUMotor channel of every motor
+        self.chans = {}
+        for m_name in self.sims:
+            self.chans[m_name] = {}
+            for key, pattern in PCUMotor.channels.items():
+                name = f"{base}:ln:{m_name}{pattern}"
+                if key == 'spmg':
+                    chan = self.ioc.registerString(name)
+                else:
+                    chan = self.ioc.registerDouble(name)
+                self.chans[m_name][key] = chan
+
+        # Initial values, and the last value seen on each input channel
+        self.last = {m_name: {} for m_name in self.sims}
+        for m_name, sim in self.sims.items():
+            for key, idle in INPUT_CHANNELS.items():
+                val = sim.read(key) if idle is None else idle
+                self.set_chan(m_name, key, val)
+                self.last[m_name][key] = val
+            for key in CONSTANT_CHANNELS:
+                self.set_chan(m_name, key, sim.read(key))
+        self.publish()
+
+        self.prepare(simStates)
+
+    def set_chan(self, m_name, key, val):
+        """ Sets a served motor channel """
+        self.chans[m_name][key].set(val.encode('UTF-8') if isinstance(val, str) else val)
+
+    def publish(self):
+        """ Writes the simulated readbacks to their channels """
+        for m_name, sim in self.sims.items():
+            for key in OUTPUT_CHANNELS:
+                val = sim.read(key)
+                # Disconnected motors stop updating
+                if val is not None:
+                    self.set_chan(m_name, key, val)
+
+    def check_inputs(self, now):
+        """ Passes client writes on to the simulated motors """
+        for m_name, sim in self.sims.items():
+            for key, idle in INPUT_CHANNELS.items():
+                val = self.chans[m_name][key].get()
+                if isinstance(val, bytes):
+                    val = val.decode('UTF-8')
+                if val is None or val == self.last[m_name].get(key):
+                    continue
+                sim.write(key, val, now)
+                self.last[m_name][key] = val
+                # Reset triggers
+                if idle is not None:
+                    self.set_chan(m_name, key, idle)
+                    self.last[m_name][key] = idle
+
+    def check_faults(self):
+        """ Applies fault injection requests """
+        request = self._fault.get()
+        if request in [None, '', b'']:
+            return
+        self._fault.set(''.encode('UTF-8'))
+        if isinstance(request, bytes):
+            request = request.decode('UTF-8')
+
+        words = request.split()
+        try:
+            if words == ['clear']:
+                for sim in self.sims.values():
+                    sim.clear()
+            elif len(words) == 2 and words[1] == 'clear':
+                self.sims[words[0]].clear()
+            elif len(words) == 2:
+                self.sims[words[0]].inject(words[1])
+            else:
+                raise ValueError("Use '<motor> <fault>', '<motor> clear' or 'clear'.")
+            self.message(f"Fault request: {request}")
+        except (KeyError, ValueError) as err:
+            self.critical(f"Invalid fault request '{request}': {err}")
+
+    def stop(self):
+        """ halts operation """
+        # Call the superclass stop method
+        super().stop()
+
+    def checkabort(self):
+        """Check if the abort flag is set, and drop into the FAULT state"""
+        if self.seqabort:
+            self.critical('Aborting sequencer!')
+            self.stop()
+
+        return False
+
+    # -------------------------------------------------------------------------
+    # Init state
+    # -------------------------------------------------------------------------
+
+    def process_INIT(self):
+        self.to_RUNNING()
+
+    # -------------------------------------------------------------------------
+    # RUNNING state
+    # -------------------------------------------------------------------------
+    def process_RUNNING(self):
+        self.checkabort()
+        now = time.time()
+        self.check_faults()
+        self.check_inputs(now)
+        for sim in self.sims.values():
+            sim.step(now)
+        self.publish()
+
+    # -------------------------------------------------------------------------
+    # TERMINATE state
+    # -------------------------------------------------------------------------
+    def process_TERMINATE(self):
+        pass
+
+# -------------------------------------------------------------------------
+# Main function
+# -------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve simulated PCU motors on local CA channels.")
+    parser.add_argument("--start", default='telescope', help="Named configuration to start at")
+    parser.add_argument("--noise", type=float, default=0, help="Readback noise (mm, rms)")
+    args = parser.parse_args()
+
+    # Only talk to local channels
+    os.environ['EPICS_CA_ADDR_LIST'] = 'localhost'
+    os.environ['EPICS_CA_AUTO_ADDR_LIST'] = 'NO'
+
+    # Define an enum of task names
+    class TASKS(Enum):
+        SimTask1 = 0
+
+    # The simulated motors
+    sim = simSequencer(start=args.start, noise=args.noise)
+
+    # Create a task pool and register the sequencers that need to run
+    tasks = Tasks(TASKS, 'k1:ao:pcu:sim', workers=len(TASKS))
+    tasks.register(sim, TASKS.SimTask1)
+
+    # Start everything
+    log.info('Starting simulated motors.')
+    tasks.run()
@@ -0,0 +1,287 @@
+from concurrent.futures import Future
+import random
+
+from kPySequencer.Sequencer import PVDisconnectException
+
+from kinematics import MotorKinematics
+from motors import CallCounter, PCUMotor
+
+# Faults that can be injected into a simulated motor
+FAULTS = ['stall', 'disconnect', 'disable', 'slow']
+# Speed factor of a motor with the 'slow' fault
+SLOW_FACTOR = 0.1
+
+# Simulated motor class
+class SimMotor():
+    """
+    A simulated PCU motor: moves to its target on a trapezoidal velocity
+    profile, with optional readback noise and injected faults. Channel
+    values use the same keys as PCUMotor.channels. Time is passed in by
+    the caller, so it can run on a real or virtual clock.
+    """
+
+    def __init__(self, m_name, position=0, velocity=10, acceleration=20, noise=0, seed=None):
+        self.m_name = m_name
+        self.kinematics = MotorKinematics(velocity, acceleration)
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.faults = set()
+
+        # Motion state
+        self.position = float(position)
+        self.target = float(position)
+        self.move_start = None
+        self.move_from = self.position
+        self.moving = False
+
+        # Software enable channel is backwards, as on the real motors
+        self.enable_val = 1
+        self.torque_val = 0
+
+    def inject(self, fault):
+        """ Adds a fault ('stall', 'disconnect', 'disable' or 'slow') """
+        if fault not in FAULTS:
+            raise ValueError(f"Unknown fault {fault}, use one of {FAULTS}.")
+        self.faults.add(fault)
+
+    def clear(self, fault=None):
+        """ Clears one fault, or all faults """
+        if fault is None:
+            self.faults.clear()
+        else:
+            self.faults.discard(fault)
+
+    @property
+    def connected(self):
+        return 'disconnect' not in self.faults
+
+    @property
+    def enabled(self):
+        return (not self.enable_val) and bool(self.torque_val) and 'disable' not in self.faults
+
+    def go(self, now):
+        """ Starts a move from the current position to the target """
+        if not self.enabled:
+            return
+        self.step(now)
+        self.move_from = self.position
+        self.move_start = now
+        self.moving = self.target != self.position
+
+    def stop(self, now):
+        """ Stops the motor where it is """
+        self.step(now)
+        self.target = self.position
+        self.moving = False
+
+    def step(self, now):
+        """ Updates the position to time now """
+        if not self.moving or 'stall' in self.faults:
+            return
+        if not self.enabled:
+            self.moving = False
+            return
+
+        distance = self.target - self.move_from
+        elapsed = now - self.move_start
+        if 'slow' in self.faults:
+            elapsed *= SLOW_FACTOR
+        travelled = float(self.kinematics.travel(elapsed, distance))
+
+        direction = 1 if distance > 0 else -1
+        self.position = self.move_from + direction*travelled
+        if travelled >= abs(distance):
+            self.position = self.target
+            self.moving = False
+
+    def finish_time(self):
+        """ Returns the time the current move will end, or None if it never will """
+        if not self.moving or 'stall' in self.faults:
+            return None
+        duration = self.kinematics.move_time(self.target - self.move_from)
+        if 'slow' in self.faults:
+            duration /= SLOW_FACTOR
+        return self.move_start + duration
+
+    def read(self, key):
+        """ Returns the value of a channel (None if disconnected) """
+        if not self.connected:
+            return None
+        if key == 'get_chan':
+            return self.position + (self.rng.gauss(0, self.noise) if self.noise else 0)
+        if key == 'moving':
+            return int(self.moving)
+        if key in ['enableRb', 'enable_chan']:
+            return self.enable_val
+        if key in ['torqueRb', 'torque_chan']:
+            return 0 if 'disable' in self.faults else self.torque_val
+        if key == 'set_chan':
+            return self.target
+        if key == 'spmg':
+            return 'Go'
+        if key == 'velo':
+            return self.kinematics.velocity
+        if key == 'accl':
+            return self.kinematics.velocity / self.kinematics.acceleration
+        return 0
+
+    def write(self, key, value, now):
+        """ Writes a channel, as a client put would. Returns False if disconnected. """
+        if not self.connected:
+            return False
+        if key == 'set_chan':
+            self.target = float(value)
+        elif key == 'go_chan' and value:
+            self.go(now)
+        elif key == 'enable_chan':
+            self.enable_val = int(value)
+        elif key == 'torque_chan':
+            self.torque_val = int(value)
+        elif key == 'spmg' and value == 'Stop':
+            self.stop(now)
+        elif key == 'halt_chan' and value:
+            self.stop(now)
+        elif key == 'home_chan' and value:
+            self.target = 0.0
+            self.go(now)
+        return True
+
+def sim_motors(motor_info, position, noise=0, seed=None):
+    """
+    Returns simulated motors (dict) for the valid motors in motor_info,
+    starting at position (dict), with speeds from its 'kinematics' section
+    """
+    kinematics = motor_info.get('kinematics', {})
+    motors = {}
+    for i, m_name in enumerate(motor_info['valid_motors']):
+        params = kinematics.get(m_name, {})
+        motors[m_name] = SimMotor(m_name, position=position.get(m_name, 0),
+                                  velocity=params.get('velocity', 10),
+                                  acceleration=params.get('acceleration', 20),
+                                  noise=noise, seed=None if seed is None else seed+i)
+    return motors
+
+# In-process motor backend
+class SimPCUMotor():
+    """
+    Drop-in replacement for PCUMotor that talks to a SimMotor directly,
+    with no Channel Access. Used by the sequencer in virtual-time runs.
+    """
+
+    # Same channels as the real motors
+    channels = PCUMotor.channels
+    snapshot_channels = PCUMotor.snapshot_channels
+
+    def __init__(self, m_name, sim, clock, base="sim"):
+        self.m_name = m_name
+        self.base = base
+        self.sim = sim
+        self.clock = clock
+        self.listeners = []
+        # Operations that would have been Channel Access calls, counted as in PCUMotor
+        self.ca_calls = CallCounter()
+        # Channel names, for error messages
+        for channel_key, channel_pat in self.channels.items():
+            setattr(self, channel_key+"_name", f"{base}:{m_name}{channel_pat}")
+
+    @classmethod
+    def factory(cls, sims, clock):
+        """ Returns a motor_class for PCUSequencer, using the simulated motors in sims (dict) """
+        return lambda m_name, **kwargs: cls(m_name, sims[m_name], clock, **kwargs)
+
+    @classmethod
+    def connect_many(cls, motors, timeout=None):
+        """ Same as PCUMotor.connect_many, nothing to wait for """
+        return [motor.get_chan_name for motor in motors.values() if not motor.connected]
+
+    @classmethod
+    def read_many(cls, motors, keys):
+        """ Same as PCUMotor.read_many, read from the simulated motors """
+        CallCounter.add_batch(motors)
+        return {m_name: {key: motor.sim.read(key) for key in keys}
+                for m_name, motor in motors.items()}
+
+    @property
+    def connected(self):
+        return self.sim.connected
+
+    @property
+    def position(self):
+        return self.sim.read('get_chan')
+
+    @property
+    def move_state(self):
+        return self.sim.read('moving')
+
+    def add_listener(self, listener):
+        """ Adds a function to be called on position or motion updates """
+        self.listeners.append(listener)
+
+    def notify(self):
+        """ Calls the listeners, as a monitor update would """
+        for listener in self.listeners:
+            listener(self)
+
+    def check_connection(self):
+        """ Raises PVDisconnectException if the motor is disconnected """
+        if not self.sim.connected:
+            raise PVDisconnectException(f"Channel {self.get_chan_name} has disconnected.")
+
+    def isEnabled(self):
+        self.ca_calls.add(2)
+        return self.sim.enabled
+
+    def isMoving(self):
+        return bool(self.move_state)
+
+    def enable(self):
+        self.check_connection()
+        self.ca_calls.add(2)
+        self.sim.write('enable_chan', 0, self.clock.time())
+        self.sim.write('torque_chan', 1, self.clock.time())
+
+    def disable(self):
+        self.check_connection()
+        self.ca_calls.add(2)
+        self.sim.write('torque_chan', 0, self.clock.time())
+        self.sim.write('enable_chan', 1, self.clock.time())
+
+    def get_pos(self):
+        self.check_connection()
+        self.ca_calls.add()
+        return self.position
+
+    def set_pos(self, pos):
+        self.check_connection()
+        self.ca_calls.add(2)
+        self.sim.write('set_chan', pos, self.clock.time())
+        self.sim.write('go_chan', 1, self.clock.time())
+
+    def put_async(self, channel_key, value):
+        """ Same as PCUMotor.put_async; completes at once unless the motor is disconnected """
+        future = Future()
+        future.pvname = getattr(self, channel_key+"_name")
+        self.ca_calls.add()
+        if self.sim.write(channel_key, value, self.clock.time()):
+            future.set_result(future.pvname)
+        return future
+
+    def enable_async(self):
+        self.check_connection()
+        return [self.put_async('enable_chan', 0), self.put_async('torque_chan', 1)]
+
+    def disable_async(self):
+        self.check_connection()
+        return [self.put_async('torque_chan', 0), self.put_async('enable_chan', 1)]
+
+    def set_pos_async(self, pos):
+        self.check_connection()
+        return [self.put_async('set_chan', pos), self.put_async('go_chan', 1)]
+
+    def stop_async(self):
+        return [self.put_async('spmg', 'Stop')]
+
+    def stop(self):
+        # No connection check, as for PCUMotor
+        self.ca_calls.add()
+        self.sim.write('spmg', 'Stop', self.clock.time())
@@ -0,0 +1,80 @@
+from collections import namedtuple
+from types import MappingProxyType
+import time
+
+from kPySequencer.Sequencer import PVDisconnectException
+
+# Readbacks of a single motor at the time of the snapshot
+class MotorReadback(namedtuple('MotorReadback', ['pos', 'moving', 'enableRb', 'torqueRb'])):
+    __slots__ = ()
+
+    @property
+    def enabled(self):
+        """ Same logic as PCUMotor.isEnabled (software enable channel is backwards) """
+        return (not self.enableRb) and bool(self.torqueRb)
+
+# Snapshot class
+class PCUSnapshot():
+    """
+    Immutable record of every motor readback, captured in one batched
+    Channel Access read at the start of a tick.
+    """
+
+    __slots__ = ('_readbacks', 'timestamp')
+
+    def __init__(self, readbacks, timestamp=None):
+        """ Initializes a snapshot from a dictionary of MotorReadbacks """
+        self._readbacks = MappingProxyType(dict(readbacks))
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @classmethod
+    def capture(cls, motors, timestamp=None):
+        """ Reads all snapshot channels of all motors (dict) at once """
+        if len(motors) == 0:
+            return cls({}, timestamp)
+
+        # Cached connection flags, no CA traffic
+        for motor in motors.values():
+            motor.check_connection()
+
+        # All motors in a sequencer share a backend
+        motor_class = type(next(iter(motors.values())))
+        values = motor_class.read_many(motors, motor_class.snapshot_channels)
+
+        readbacks = {}
+        for m_name, m_values in values.items():
+            # A missing value means the channel did not respond
+            for key, val in m_values.items():
+                if val is None:
+                    raise PVDisconnectException(f"Channel {getattr(motors[m_name], key+'_name')} " +
+                                                "has disconnected.")
+            readbacks[m_name] = MotorReadback(*[m_values[key] for key in motor_class.snapshot_channels])
+
+        return cls(readbacks, timestamp)
+
+    def __contains__(self, m_name):
+        return m_name in self._readbacks
+
+    def __getitem__(self, m_name):
+        return self._readbacks[m_name]
+
+    def __str__(self):
+        return f"Snapshot at {self.timestamp:.3f}: " + \
+            ', '.join([f'{m}: {rb.pos}' for m, rb in self._readbacks.items()])
+
+    def __repr__(self):
+        return str(self)
+
+    def position(self, m_name):
+        """ Returns the position of one motor """
+        return self._readbacks[m_name].pos
+
+    def positions(self):
+        """ Returns a (new) dictionary of positions of all motors """
+        return {m_name: rb.pos for m_name, rb in self._readbacks.items()}
+
+    def is_moving(self, m_name):
+        return bool(self._readbacks[m_name].moving)
+
+    def is_enabled(self, m_name):
+        return self._readbacks[m_name].enabled
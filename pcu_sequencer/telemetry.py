@@ -0,0 +1,163 @@
+import os
+
+import numpy as np
+
+from PCU_util import keep_previous
+
+MAGIC = b'PCUTLM01'
+VERSION = 1
+MAX_MOTORS = 8
+# Shortest time between samples (seconds)
+TELEMETRY_INTERVAL = 0.1
+# Records kept in the ring buffer
+TELEMETRY_CAPACITY = 100000
+
+# File header: identifies the layout and counts the records written
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('n_motors', '<u4'),
+    ('capacity', '<u8'),
+    ('count', '<u8'),
+    ('motors', 'S8', (MAX_MOTORS,)),
+])
+
+def record_dtype(n_motors):
+    """ Returns the (packed) record layout for n_motors motors """
+    return np.dtype([
+        ('time', '<f8'),
+        ('state', 'u1'),
+        ('moving', 'u1', (n_motors,)),
+        ('pos', '<f4', (n_motors,)),
+    ])
+
+# Telemetry recorder class
+class TelemetryRecorder():
+    """
+    Writes motor positions, motion flags and the sequencer state into a
+    fixed-size ring buffer in a memory-mapped file, at most once per interval.
+    Recording a sample writes in place and allocates nothing per record.
+    """
+
+    def __init__(self, path, motors, capacity=TELEMETRY_CAPACITY, interval=TELEMETRY_INTERVAL):
+        """ 
+        Opens the file at path for the given motor names. An existing file with
+        the same layout is continued from its count, so a restart keeps the
+        records from before it; any other file there is renamed and kept.
+        """
+        if len(motors) > MAX_MOTORS:
+            raise ValueError(f"At most {MAX_MOTORS} motors can be recorded.")
+        self.path = path
+        self.motors = list(motors)
+        self.capacity = capacity
+        self.interval = interval
+        self.last_time = None
+        self.last_state = None
+
+        dtype = record_dtype(len(self.motors))
+        size = HEADER_DTYPE.itemsize + capacity*dtype.itemsize
+        resume = self.compatible(path, size)
+        if not resume:
+            keep_previous(path)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        self._map = np.memmap(path, dtype='u1', mode='r+', shape=(size,))
+
+        self.header = self._map[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        if not resume:
+            self.header['magic'] = MAGIC
+            self.header['version'] = VERSION
+            self.header['n_motors'] = len(self.motors)
+            self.header['capacity'] = capacity
+            self.header['count'] = 0
+            self.header['motors'][0, :len(self.motors)] = [m.encode('UTF-8') for m in self.motors]
+
+        # Field views of the records, written in place
+        self.records = self._map[HEADER_DTYPE.itemsize:].view(dtype)
+        self._time = self.records['time']
+        self._state = self.records['state']
+        self._moving = self.records['moving']
+        self._pos = self.records['pos']
+        self.count = int(self.header['count'][0])
+
+    def compatible(self, path, size):
+        """ Checks whether the file at path has this recorder's layout """
+        try:
+            if os.path.getsize(path) != size:
+                return False
+            header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        except OSError:
+            return False
+        motors = [m.encode('UTF-8') for m in self.motors]
+        return (len(header) == 1 and header['magic'][0] == MAGIC and
+                header['version'][0] == VERSION and header['capacity'][0] == self.capacity and
+                header['n_motors'][0] == len(motors) and
+                list(header['motors'][0, :len(motors)]) == motors)
+
+    def record(self, now, state, snapshot):
+        """ Records a PCUSnapshot and the state (int) at time now, if the interval has passed """
+        if self.last_time is not None and now - self.last_time < self.interval:
+            return False
+        self.last_time = now
+
+        i = self.count % self.capacity
+        self._time[i] = now
+        self._state[i] = state
+        for j, m_name in enumerate(self.motors):
+            if m_name in snapshot:
+                rb = snapshot[m_name]
+                self._pos[i, j] = rb.pos
+                self._moving[i, j] = rb.moving
+        # Publish the record after it is complete
+        self.count += 1
+        self.header['count'] = self.count
+
+        # Keep the file current around state changes (e.g. faults)
+        if state != self.last_state:
+            self.last_state = state
+            self.flush()
+        return True
+
+    def flush(self):
+        self._map.flush()
+
+# Telemetry reader class
+class TelemetryReader():
+    """ Reads a telemetry file as NumPy views of the mapped records (no copies) """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype='u1', mode='r')
+        self.header = self._map[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        if self.header['magic'][0] != MAGIC:
+            raise ValueError(f"{path} is not a PCU telemetry file.")
+
+        n_motors = int(self.header['n_motors'][0])
+        self.motors = [m.decode('UTF-8') for m in self.header['motors'][0, :n_motors]]
+        self.capacity = int(self.header['capacity'][0])
+        self.records = self._map[HEADER_DTYPE.itemsize:].view(record_dtype(n_motors))
+
+    @property
+    def count(self):
+        """ Total records written (including overwritten ones) """
+        return int(self.header['count'][0])
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def segments(self):
+        """ Returns the stored records, oldest first, as up to two views of the file """
+        count = self.count
+        if count <= self.capacity:
+            return [self.records[:count]]
+        start = count % self.capacity
+        return [self.records[start:], self.records[:start]]
+
+    def to_array(self):
+        """ Returns all stored records, oldest first (one copy if the buffer has wrapped) """
+        segments = self.segments()
+        return segments[0] if len(segments) == 1 else np.concatenate(segments)
+
+    def column(self, m_name):
+        """ Returns the index of a motor in the pos and moving fields """
+        return self.motors.index(m_name)
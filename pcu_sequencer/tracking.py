@@ -0,0 +1,45 @@
+# Shortest time between writes to the motors while tracking
+TRACK_INTERVAL = 0.1 # seconds
+
+# Offset tracker class
+class OffsetTracker():
+    """
+    Follows a stream of target positions, keeping only the newest
+    (latest wins) and rate-limiting how often a new target is sent.
+    """
+
+    def __init__(self, tolerance, min_interval=TRACK_INTERVAL):
+        """ Initializes with motor tolerances (dict) and the minimum time between sends """
+        self.tolerance = tolerance
+        self.min_interval = min_interval
+        self.reset()
+
+    def reset(self):
+        """ Forgets all targets """
+        self.target = None
+        self.sent = None
+        self.last_send = None
+
+    def update(self, target):
+        """ Replaces the pending target (dict) with a newer one """
+        self.target = target
+
+    def is_new(self, target):
+        """ Checks whether target differs from the last sent target beyond tolerance """
+        if self.sent is None:
+            return True
+        return any(abs(val - self.sent.get(m_name, val)) >= self.tolerance[m_name]
+                   for m_name, val in target.items())
+
+    def due(self, now):
+        """ Returns the pending target if it is new and may be sent now, else None """
+        if self.target is None or not self.is_new(self.target):
+            return None
+        if self.last_send is not None and now - self.last_send < self.min_interval:
+            return None
+        return self.target
+
+    def sent_target(self, target, now):
+        """ Records that target was sent to the motors at time now """
+        self.sent = target
+        self.last_send = now
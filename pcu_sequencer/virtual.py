@@ -0,0 +1,130 @@
+import heapq
+import itertools
+
+import PCU_util as util
+from clock import VirtualClock
+from simulation import SimPCUMotor, sim_motors
+from sequencer import PCUSequencer, PCUStates
+
+# Shortest step of the virtual clock when skipping ahead (seconds)
+MIN_STEP = 1e-6
+
+# Virtual-time driver class
+class VirtualDriver():
+    """
+    Runs a PCUSequencer and its simulated motors on a shared virtual clock.
+    Each tick calls the handler for the current state, advances the clock,
+    steps the motors and advances the move queue (as the completion engine
+    would). With skip=True, the clock jumps straight to the next event
+    (end of a motor move, dwell or timeout, or a scheduled action) while
+    nothing else can happen, so moves take a few ticks each.
+    """
+
+    def __init__(self, sequencer, sims, clock, skip=True):
+        self.sequencer = sequencer
+        self.sims = sims
+        self.clock = clock
+        self.skip = skip
+        self.ticks = 0
+        # Scheduled actions: (time, order, function)
+        self.actions = []
+        self._order = itertools.count()
+
+    @classmethod
+    def create(cls, start='telescope', noise=0, seed=0, enabled=True,
+               prefix="k1:ao:pcu:virtual", skip=True, **kwargs):
+        """
+        Returns a driver for a new sequencer with simulated motors at the
+        named configuration start. Other arguments go to PCUSequencer.
+        """
+        clock = VirtualClock()
+        compiled = util.store.load()
+        sims = sim_motors(compiled.motor_info, compiled.all_configs[start], noise=noise, seed=seed)
+        if enabled:
+            for sim in sims.values():
+                sim.write('enable_chan', 0, clock.time())
+                sim.write('torque_chan', 1, clock.time())
+
+        sequencer = PCUSequencer(prefix, clock=clock, motor_class=SimPCUMotor.factory(sims, clock),
+                                 **kwargs)
+        return cls(sequencer, sims, clock, skip=skip)
+
+    @property
+    def state(self):
+        return self.sequencer.state
+
+    def at(self, t, action):
+        """ Schedules a function to be called at virtual time t """
+        heapq.heappush(self.actions, (t, next(self._order), action))
+
+    def request_config(self, name):
+        """ Requests a configuration, as a write to the pos channel would """
+        self.sequencer._pos.set(name.encode('UTF-8'))
+
+    def next_step(self):
+        """ Returns the time (s) until the next tick """
+        seq = self.sequencer
+        if not self.skip or seq.tracking or seq.state not in [PCUStates.INPOS, PCUStates.MOVING,
+                                                              PCUStates.FAULT]:
+            return seq.tickrate
+        now = self.clock.time()
+
+        events = [self.actions[0][0]] if len(self.actions) != 0 else []
+        if seq.state == PCUStates.MOVING:
+            dwelling = seq.pattern_active and seq.dwell_end > now
+            # The next stage is triggered on the next tick
+            if not dwelling and not any(sim.moving for sim in self.sims.values()):
+                return seq.tickrate
+            events += [sim.finish_time() for sim in self.sims.values()]
+            events.append(seq.move_timer.end)
+            if dwelling:
+                events.append(seq.dwell_end)
+
+        events = [t for t in events if t is not None and t > now]
+        if len(events) == 0:
+            return seq.tickrate
+        return max(min(events) - now, MIN_STEP)
+
+    def tick(self, until=None):
+        """ Runs one sequencer tick and advances the clock (no further than until) """
+        seq = self.sequencer
+
+        # Scheduled actions that are due
+        while len(self.actions) != 0 and self.actions[0][0] <= self.clock.time():
+            _, _, action = heapq.heappop(self.actions)
+            action()
+
+        getattr(seq, f"process_{seq.state.name}")()
+        self.ticks += 1
+
+        dt = self.next_step()
+        if until is not None:
+            dt = min(dt, until - self.clock.time())
+        self.clock.advance(max(dt, 0))
+
+        now = self.clock.time()
+        for sim in self.sims.values():
+            sim.step(now)
+        # Monitor updates would wake the completion engine here
+        seq.advance_moves()
+
+    def run(self, duration):
+        """ Runs for duration seconds of virtual time """
+        end = self.clock.time() + duration
+        while self.clock.time() < end:
+            self.tick(until=end)
+
+    def run_until(self, condition, timeout):
+        """ Runs until condition() is True, for at most timeout seconds. Returns condition(). """
+        end = self.clock.time() + timeout
+        while not condition() and self.clock.time() < end:
+            self.tick(until=end)
+        return condition()
+
+    def move_to(self, name, timeout=600):
+        """ Requests a configuration and runs until the move ends. Returns the final state. """
+        self.run_until(lambda: self.sequencer.state != PCUStates.INIT, timeout)
+        self.request_config(name)
+        self.tick()
+        self.run_until(lambda: self.sequencer.state != PCUStates.MOVING, timeout)
+        return self.sequencer.state
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# The sequencer modules import each other by name, so put them on the path
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pcu_sequencer')
+sys.path.insert(0, PACKAGE_DIR)
+
+from configs import ConfigStore
+from geometry import PCUGeometry
+from positions import PCUPos
+
+@pytest.fixture(scope='session')
+def compiled():
+    """ The configuration and motor files in the repository, compiled """
+    store = ConfigStore(os.path.join(PACKAGE_DIR, 'PCU_configurations.yaml'),
+                        os.path.join(PACKAGE_DIR, 'motor_configurations.yaml'))
+    return store.load()
+
+@pytest.fixture(scope='session')
+def geometry(compiled):
+    """ Collision model built from the repository's files """
+    return PCUGeometry.from_compiled(compiled, PCUPos.valid_motors)
+
+# Stand-in for an IOC channel
+class FakeChannel():
+    """ Keeps the last value and counts set() calls """
+
+    def __init__(self, value=0):
+        self.value = value
+        self.sets = 0
+
+    def get(self):
+        return self.value
+
+    def set(self, val):
+        self.value = val
+        self.sets += 1
+
+# Stand-in for the sequencer's IOC
+class FakeIOC():
+    """ Registers FakeChannels by name """
+
+    def __init__(self):
+        self.channels = {}
+
+    def registerDouble(self, name, initial_value=0):
+        self.channels[name] = FakeChannel(initial_value)
+        return self.channels[name]
@@ -0,0 +1,46 @@
+from channels import ChangedChannel
+from conftest import FakeChannel
+
+def test_first_write_posts():
+    chan = FakeChannel(value=0)
+    changed = ChangedChannel(chan)
+    # Posts even when equal to the channel's initial value
+    changed.set(0)
+    assert chan.sets == 1
+
+def test_unchanged_not_posted():
+    chan = FakeChannel()
+    changed = ChangedChannel(chan)
+    for val in [1, 1, 2, 2, 1]:
+        changed.set(val)
+    assert chan.sets == 3
+    assert changed.get() == 1
+
+def test_deadband():
+    chan = FakeChannel()
+    changed = ChangedChannel(chan, deadband=0.1)
+    changed.set(1.0)
+    changed.set(1.05)
+    changed.set(0.95)
+    assert chan.sets == 1 and chan.value == 1.0
+    # Compared to the last posted value, not the last requested one
+    changed.set(1.15)
+    assert chan.sets == 2 and chan.value == 1.15
+
+def test_non_numeric():
+    chan = FakeChannel()
+    changed = ChangedChannel(chan, deadband=1)
+    for val in ['telescope', 'telescope', 'fiber_bundle', b'fiber_bundle']:
+        changed.set(val)
+    assert chan.sets == 3
+    # A number after a string always posts
+    changed.set(0)
+    assert chan.sets == 4
+
+def test_reset():
+    chan = FakeChannel()
+    changed = ChangedChannel(chan)
+    changed.set(5)
+    changed.reset()
+    changed.set(5)
+    assert chan.sets == 2
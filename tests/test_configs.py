@@ -0,0 +1,31 @@
+import os
+
+from conftest import PACKAGE_DIR
+from configs import ConfigMatcher, ConfigStore
+
+MOTORS = ['m1', 'm2']
+TOLERANCE = {'m1': 0.1, 'm2': 0.1}
+CONFIGS = {'home': {'m1': 0, 'm2': 0}, 'fiber': {'m1': 150, 'm2': 120}}
+
+def test_match_within_tolerance():
+    matcher = ConfigMatcher.from_configs(CONFIGS, MOTORS, TOLERANCE)
+    assert matcher.match({'m1': 150.05, 'm2': 119.95}) == 'fiber'
+    assert matcher.match({'m1': 0, 'm2': 0}) == 'home'
+
+def test_no_match_outside_tolerance():
+    matcher = ConfigMatcher.from_configs(CONFIGS, MOTORS, TOLERANCE)
+    assert matcher.match({'m1': 150.2, 'm2': 120}) is None
+
+def test_empty_matcher():
+    assert ConfigMatcher.from_configs({}, MOTORS, TOLERANCE).match({'m1': 0, 'm2': 0}) is None
+
+def test_store_reuses_unchanged_files(tmp_path):
+    for name in ['PCU_configurations.yaml', 'motor_configurations.yaml']:
+        with open(os.path.join(PACKAGE_DIR, name)) as f:
+            (tmp_path / name).write_text(f.read())
+    store = ConfigStore(str(tmp_path / 'PCU_configurations.yaml'), str(tmp_path / 'motor_configurations.yaml'))
+    compiled = store.load()
+    assert store.load() is compiled
+    # Touched but unchanged
+    os.utime(tmp_path / 'PCU_configurations.yaml', ns=(0, 0))
+    assert store.load() is compiled
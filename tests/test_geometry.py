@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from conftest import PACKAGE_DIR
+from geometry import PCUGeometry
+from positions import PCUPos, PCUPosArray
+
+# Fiber: rectangle m1 [115, 185], m2 [85, 155], circle of 35 mm around (150, 120)
+# Mask: rectangle m1 [95, 115], m2 [175, 190], inside its circle around (105, 184)
+
+def fiber(m1, m2, m4=50):
+    return {'m1': m1, 'm2': m2, 'm3': 0, 'm4': m4}
+
+def mask(m1, m2, m3=50):
+    return {'m1': m1, 'm2': m2, 'm3': m3, 'm4': 0}
+
+@pytest.mark.parametrize("pos, valid", [
+    (fiber(150, 120), True),
+    # Edges of the rectangle, inside the circle
+    (fiber(150, 86), True),
+    (fiber(150, 84), False),
+    (fiber(116, 120), True),
+    (fiber(114, 120), False),
+    # Corners of the rectangle are outside the circle
+    (fiber(115, 85), False),
+    (fiber(185, 155), False),
+    (fiber(120, 90), False),
+    (fiber(140, 90), True),
+    # Corners of the mask rectangle (inclusive), inside its circle
+    (mask(95, 175), True),
+    (mask(115, 190), True),
+    (mask(94.9, 175), False),
+    (mask(115, 174.9), False),
+    # Both elements extended
+    ({'m1': 105, 'm2': 184, 'm3': 50, 'm4': 50}, False),
+    # Retracted anywhere within the motor limits
+    (fiber(0, 0, m4=0), True),
+    (fiber(300, 190, m4=0), True),
+    (fiber(301, 0, m4=0), False),
+    (fiber(0, -1, m4=0), False),
+])
+def test_is_valid(geometry, pos, valid):
+    assert bool(geometry.is_valid(pos)[0]) == valid
+    assert PCUPos(pos, geometry=geometry).is_valid() == valid
+
+def test_array_matches_single_positions(geometry):
+    rng = np.random.default_rng(0)
+    data = np.column_stack([rng.uniform(90, 190, 500), rng.uniform(80, 195, 500),
+                            rng.choice([0, 50], 500), rng.choice([0, 50], 500)])
+    positions = PCUPosArray(data, geometry=geometry)
+    expected = [positions[i].is_valid() for i in range(len(positions))]
+    assert list(positions.is_valid()) == expected
+
+def test_move_in_hole(geometry):
+    start = PCUPos(fiber(150, 120), geometry=geometry)
+    assert start.move_in_hole(PCUPos(fiber(140, 125), geometry=geometry))
+    # Same XY, but the other hole
+    assert not start.move_in_hole(PCUPos(mask(105, 184), geometry=geometry))
+    # Destination outside the hole
+    assert not start.move_in_hole(PCUPos(fiber(105, 60), geometry=geometry))
+
+def test_geometry_is_per_position(compiled):
+    wide = PCUGeometry.from_compiled(compiled, PCUPos.valid_motors)
+    narrow = PCUGeometry.from_compiled(compiled, PCUPos.valid_motors, clearance={'mask': 5, 'fiber': 5})
+    pos = fiber(140, 120)
+    assert PCUPos(pos, geometry=wide).is_valid()
+    assert not PCUPos(pos, geometry=narrow).is_valid()
+    assert PCUPos(pos, geometry=wide).is_valid()
+
+def test_default_geometry(monkeypatch):
+    # PCU_util finds the configuration files relative to the package
+    monkeypatch.chdir(PACKAGE_DIR)
+    assert PCUPos(fiber(150, 120)).is_valid()
+    assert not PCUPos(fiber(105, 60)).is_valid()
+    assert (PCUPos(fiber(150, 120)) + PCUPos(m1=1)).in_hole('fiber')
+    assert PCUPos(fiber(150, 120)).move_in_hole(PCUPos(fiber(140, 125)))
+    assert list(PCUPosArray.from_dicts([fiber(150, 120), fiber(105, 60)]).is_valid()) == [True, False]
+    assert PCUPos(fiber(150, 120)).get_geometry() is PCUPos(mask(105, 184)).get_geometry()
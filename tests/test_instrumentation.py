@@ -0,0 +1,98 @@
+import pytest
+
+from conftest import FakeIOC
+from instrumentation import CA_EDGES, RollingHistogram, TickStats, PUBLISH_INTERVAL
+
+def test_empty_histogram():
+    assert RollingHistogram(CA_EDGES).percentiles(50, 99) == [0, 0]
+
+def test_percentile_ranks():
+    histogram = RollingHistogram(CA_EDGES)
+    for val in range(10):
+        histogram.add(val)
+    assert histogram.percentiles(10, 50, 99, 100) == [0, 4, 9, 9]
+
+def test_bins_round_up_to_edges():
+    histogram = RollingHistogram([1, 10, 100])
+    histogram.add(2)
+    assert histogram.percentiles(50) == [10]
+
+def test_overflow_bin():
+    histogram = RollingHistogram(CA_EDGES)
+    histogram.add(1000)
+    assert histogram.counts[-1] == 1
+    # Reported as the largest edge
+    assert histogram.percentiles(50) == [CA_EDGES[-1]]
+
+def test_window_eviction():
+    histogram = RollingHistogram(CA_EDGES, window=4)
+    for val in [1]*4 + [5]*3:
+        histogram.add(val)
+    assert histogram.n == 4
+    assert histogram.counts[1] == 1 and histogram.counts[5] == 3
+    assert histogram.percentiles(25, 50) == [1, 5]
+    histogram.add(5)
+    assert histogram.counts[1] == 0
+    assert histogram.percentiles(0.1) == [5]
+
+class Counter():
+    """ Clock or CA call counter that the test advances """
+
+    def __init__(self):
+        self.value = 0
+
+    def __call__(self):
+        return self.value
+
+@pytest.fixture
+def stats():
+    ioc, clock, calls = FakeIOC(), Counter(), Counter()
+    stats = TickStats(ioc, 'pcu', ['check_offsets'], counter=calls, clock=clock)
+    return stats, ioc, clock, calls
+
+def run_tick(stats, clock, calls, duration, n_calls, period=0.5):
+    stats.begin_tick()
+    clock.value += duration
+    calls.value += n_calls
+    stats.end_tick(period)
+
+def test_overruns(stats):
+    stats, ioc, clock, calls = stats
+    run_tick(stats, clock, calls, 0.3, 0)
+    assert stats.overruns == 0
+    run_tick(stats, clock, calls, 0.6, 0)
+    assert stats.overruns == 1
+    # No tick in progress
+    stats.end_tick(0.5)
+    assert stats.overruns == 1
+
+def test_ca_calls_per_tick(stats):
+    stats, ioc, clock, calls = stats
+    for n in [1, 3, 3]:
+        run_tick(stats, clock, calls, 0.01, n)
+    assert stats.ca_calls.percentiles(50, 99) == [3, 3]
+
+def test_timed_methods(stats):
+    stats, ioc, clock, calls = stats
+    class Seq():
+        def check_offsets(self):
+            clock.value += 2e-3
+            return 'done'
+    seq = Seq()
+    stats.wrap(seq)
+    assert seq.check_offsets() == 'done'
+    assert stats.latency['check_offsets'].n == 1
+    assert stats.latency['check_offsets'].percentiles(50)[0] == pytest.approx(2e-3, rel=0.4)
+
+def test_publish_throttle(stats):
+    stats, ioc, clock, calls = stats
+    overruns = ioc.channels['pcu:overrunsRb']
+    stats.publish(0)
+    assert overruns.sets == 1 and overruns.value == 0
+    run_tick(stats, clock, calls, 1.0, 0)
+    stats.publish(PUBLISH_INTERVAL/2)
+    assert overruns.value == 0
+    stats.publish(PUBLISH_INTERVAL)
+    assert overruns.value == 1
+    assert ioc.channels['pcu:tickP50'].value >= 1.0
+    assert 'pcu:checkOffsetsP99' in ioc.channels and 'pcu:caCallsP50' in ioc.channels
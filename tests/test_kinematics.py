@@ -0,0 +1,38 @@
+import pytest
+
+from kinematics import PCUKinematics
+
+MOTOR_INFO = {
+    'kinematics': {'m1': {'velocity': 10, 'acceleration': 20, 'settle': 0.5},
+                   'm2': {'velocity': 10, 'acceleration': 20, 'settle': 0.5}},
+    'move_timeout': {'factor': 1.5, 'margin': 3, 'minimum': 5},
+}
+
+def test_records_override_file():
+    records = {'m1': {'velo': 2, 'accl': 0.5}, 'm2': {'velo': None, 'accl': None}}
+    model = PCUKinematics.from_motor_info(MOTOR_INFO, records=records)
+    assert model.sources == {'m1': 'record', 'm2': 'file'}
+    assert model.motors['m1'].velocity == 2
+    assert model.motors['m1'].acceleration == pytest.approx(4)
+    # Settle time still comes from the file
+    assert model.motors['m1'].settle == 0.5
+    assert model.motors['m2'].velocity == 10
+
+@pytest.mark.parametrize('fields', [{'velo': 0, 'accl': 0.5}, {'velo': 2, 'accl': 0}, {}])
+def test_unusable_records_fall_back(fields):
+    model = PCUKinematics.from_motor_info(MOTOR_INFO, records={'m1': fields})
+    assert model.sources['m1'] == 'file'
+    assert model.motors['m1'].velocity == 10
+
+def test_timeout_minimum():
+    model = PCUKinematics.from_motor_info(MOTOR_INFO)
+    # Short moves get the floor, long ones scale with the prediction
+    assert model.timeout(0.1) == 5
+    assert model.timeout(2) == 6
+    assert model.timeout(28) == pytest.approx(45)
+
+def test_stall_detected_in_seconds():
+    model = PCUKinematics.from_motor_info(MOTOR_INFO)
+    # A 0.01 mm dither step
+    move_time = model.move_time({'m1': 100, 'm2': 100}, {'m1': 100.01})
+    assert model.timeout(move_time) < 10
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import patterns
+from patterns import MAX_POINTS, parse_pattern
+
+def test_grid_is_serpentine():
+    points = parse_pattern('grid 3 2 1')
+    assert points.shape == (6, 2)
+    # Rows alternate direction in X
+    assert list(points[:3, 0]) == [-1, 0, 1]
+    assert list(points[3:, 0]) == [1, 0, -1]
+
+def test_grid_separate_spacing():
+    points = parse_pattern('grid 2 2 1 4')
+    assert sorted(set(points[:, 1])) == [-2, 2]
+
+def test_spiral_starts_at_center():
+    points = parse_pattern('spiral 10 0.5')
+    assert points.shape == (10, 2)
+    assert np.allclose(points[0], 0)
+
+def test_list_is_nearest_neighbor():
+    points = parse_pattern('list 3,0 1,0 2,0')
+    assert points.tolist() == [[1, 0], [2, 0], [3, 0]]
+
+def test_largest_allowed():
+    assert len(parse_pattern(f'spiral {MAX_POINTS} 0.1')) == MAX_POINTS
+
+@pytest.mark.parametrize('spec', [
+    '',
+    'circle 3 1',
+    'grid 3 3',
+    'grid a 3 1',
+    'grid 0 3 1',
+    'grid -2 -2 1',
+    'grid 100000 100000 1',
+    f'grid {MAX_POINTS} 2 1',
+    'spiral 10',
+    'spiral 0 1',
+    f'spiral {MAX_POINTS+1} 1',
+    'list',
+    'list 1,2,3',
+    'list 1,nan',
+    'grid 2 2 inf',
+    'list ' + ' '.join(['0,0']*(MAX_POINTS+1)),
+])
+def test_rejected(spec):
+    with pytest.raises(ValueError):
+        parse_pattern(spec)
+
+def test_oversized_grid_is_not_built(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("grid was built")
+    monkeypatch.setattr(patterns, 'grid', fail)
+    with pytest.raises(ValueError, match='limit'):
+        parse_pattern('grid 100000 100000 1')
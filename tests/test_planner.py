@@ -0,0 +1,113 @@
+import itertools
+
+import pytest
+
+from planner import MovePlanner, HOME
+from positions import PCUPos
+
+@pytest.fixture(scope='module')
+def planner(compiled, geometry):
+    # All four motors, so both Z stages are planned
+    return MovePlanner(PCUPos.valid_motors, compiled.tolerance, geometry=geometry)
+
+def config_pairs(compiled):
+    return list(itertools.permutations(compiled.all_configs, 2))
+
+def check_z_first(planner, current, destination):
+    """ Checks that X and Y only move with both Z stages home """
+    stages = planner.plan(current, destination)
+    z_out = [m for m in planner.z_motors if abs(getattr(current, m) - HOME) >= planner.tolerance[m]]
+    moves_xy = any(m in stage for stage in stages for m in planner.xy_motors)
+
+    if moves_xy and z_out:
+        # Z homes first, on its own
+        assert stages[0] == {m: HOME for m in z_out}
+    pos = current
+    for stage in stages:
+        assert not planner.mixes_z(stage)
+        if any(m in stage for m in planner.xy_motors):
+            assert all(getattr(pos, m) == HOME for m in planner.z_motors)
+        pos = planner.after(pos, stage)
+    return stages
+
+def test_z_first_between_configurations(compiled, geometry, planner):
+    for start, end in config_pairs(compiled):
+        current = PCUPos(compiled.all_configs[start], name=start, geometry=geometry)
+        destination = PCUPos(compiled.all_configs[end], name=end, geometry=geometry)
+        if current.move_in_hole(destination):
+            # A single stage that is safe for any axis timing
+            stages = planner.plan(current, destination)
+            assert len(stages) <= 1
+            assert planner.check(current, stages) is None
+            continue
+        stages = check_z_first(planner, current, destination)
+        assert planner.check(current, stages) is None, (start, end, stages)
+
+@pytest.mark.parametrize("end", ['kpf_mirror', 'telescope', 'telescope_sim', 'pinhole_mask'])
+def test_partly_extended_fiber_homes_first(compiled, geometry, planner, end):
+    # Fiber 1 mm into the hole at fiber_bundle
+    current = PCUPos(dict(compiled.all_configs['fiber_bundle'], m4=1), geometry=geometry)
+    destination = PCUPos(compiled.all_configs[end], geometry=geometry)
+    stages = check_z_first(planner, current, destination)
+    assert stages[0] == {'m4': HOME}
+    assert len(stages) >= 2
+
+@pytest.mark.parametrize("end", ['telescope', 'kpf_mirror', 'fiber_bundle'])
+def test_retract_from_invalid_position(compiled, geometry, planner, end):
+    # Fiber extended outside its rectangle, e.g. after a fault
+    current = PCUPos(dict(compiled.all_configs['fiber_bundle'], m1=112, m4=10), geometry=geometry)
+    assert not current.is_valid()
+    destination = PCUPos(compiled.all_configs[end], geometry=geometry)
+    stages = planner.plan(current, destination)
+    assert stages[0] == {'m4': HOME}
+    assert planner.check(current, stages) is None
+
+def test_extending_from_invalid_position_is_refused(compiled, geometry, planner):
+    current = PCUPos(dict(compiled.all_configs['fiber_bundle'], m1=112, m4=10), geometry=geometry)
+    assert planner.check(current, [{'m4': 20}]) == 0
+    assert planner.check(current, [{'m1': 150}]) == 0
+
+def test_merge_keeps_z_separate(compiled, geometry, planner):
+    current = PCUPos(compiled.all_configs['fiber_bundle'], geometry=geometry)
+    stages = [{'m4': HOME}, {'m1': 105, 'm2': 60}]
+    assert planner.merge(current, stages) == stages
+
+def test_in_hole_move_is_one_stage(compiled, geometry, planner):
+    current = PCUPos(compiled.all_configs['fiber_bundle'], geometry=geometry)
+    destination = PCUPos(dict(compiled.all_configs['fiber_bundle'], m1=145, m2=125), geometry=geometry)
+    assert planner.plan(current, destination) == [{'m1': 145, 'm2': 125}]
+
+def test_path_valid_needs_whole_box(geometry):
+    # Both ends inside the fiber circle, but the corner (120, 95) is not
+    start = {'m1': 120, 'm2': 120, 'm3': 0, 'm4': 50}
+    end = {'m1': 150, 'm2': 95, 'm3': 0, 'm4': 50}
+    assert geometry.is_valid(start)[0] and geometry.is_valid(end)[0]
+    assert not geometry.is_valid({'m1': 120, 'm2': 95, 'm3': 0, 'm4': 50})[0]
+    assert not geometry.path_valid(start, end)
+    # Retracting first makes the same XY move safe
+    assert geometry.path_valid(dict(start, m4=0), dict(end, m4=0))
+    # Straight in or out of the hole at a fixed XY
+    assert geometry.path_valid(start, dict(start, m4=0))
+
+def test_path_valid_at_circle_and_rectangle_corners(geometry):
+    center = {'m1': 150, 'm2': 120, 'm3': 0, 'm4': 50}
+    # Along one axis to just inside each rectangle edge
+    for m_name, val in [('m1', 116), ('m1', 184), ('m2', 86), ('m2', 154)]:
+        assert geometry.path_valid(center, dict(center, **{m_name: val}))
+    # Diagonally, where the circle cuts off the rectangle corner
+    assert not geometry.path_valid(center, dict(center, m1=180, m2=150))
+    assert geometry.path_valid(center, dict(center, m1=170, m2=140))
+
+def test_in_hole_move_near_circle_edge_is_staged(compiled, geometry, planner):
+    # Both ends in the fiber hole, but the box between them leaves the circle
+    current = PCUPos(dict(compiled.all_configs['fiber_bundle'], m1=120, m2=120), geometry=geometry)
+    destination = PCUPos(dict(compiled.all_configs['fiber_bundle'], m1=150, m2=95), geometry=geometry)
+    assert current.move_in_hole(destination)
+    stages = check_z_first(planner, current, destination)
+    assert stages[0] == {'m4': HOME}
+
+def test_no_fast_path_without_geometry(compiled, geometry):
+    planner = MovePlanner(PCUPos.valid_motors, compiled.tolerance)
+    current = PCUPos(compiled.all_configs['fiber_bundle'], geometry=geometry)
+    destination = PCUPos(dict(compiled.all_configs['fiber_bundle'], m1=145), geometry=geometry)
+    assert planner.plan(current, destination)[0] == {'m4': HOME}
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+# The sequencer needs the KTL sequencer framework and pyepics
+pytest.importorskip('kPySequencer')
+pytest.importorskip('epics')
+
+from conftest import PACKAGE_DIR
+
+@pytest.fixture
+def recorded(tmp_path, monkeypatch):
+    """ Records a virtual-time run: a few reconfigurations, then a stalled motor """
+    # Configuration files are found relative to the package
+    monkeypatch.chdir(PACKAGE_DIR)
+    from replay import TrafficRecorder
+    from virtual import VirtualDriver
+
+    path = str(tmp_path / 'run.trf')
+    recorder = TrafficRecorder(path)
+    driver = VirtualDriver.create(traffic=recorder)
+    for name in ['fiber_bundle', 'pinhole_mask', 'telescope']:
+        driver.move_to(name)
+    driver.sims['m2'].inject('stall')
+    driver.move_to('fiber_bundle')
+    recorder.close()
+    return path, driver.sequencer
+
+def test_round_trip(recorded):
+    from replay import TrafficPlayer
+    path, original = recorded
+    player = TrafficPlayer(path)
+    replayed = player.build()
+    assert player.run() > 0
+    assert player.divergences == []
+    assert replayed.state == original.state
+    assert replayed.configuration == original.configuration
+
+def test_divergence_detected(recorded):
+    from replay import TrafficPlayer, WRITE
+    path, _ = recorded
+    player = TrafficPlayer(path)
+    player.build()
+    # Make the recording disagree with the first move the sequencer writes
+    for start, body in player.segments:
+        writes = [i for i, event in enumerate(body) if event.kind == WRITE and event.name == 'm1.set_chan']
+        if len(writes) != 0:
+            body[writes[0]] = body[writes[0]]._replace(value=body[writes[0]].value + 1)
+            break
+    player.run()
+    assert len(player.divergences) == 1
+
+def test_restart_keeps_previous_log(recorded):
+    from replay import TrafficRecorder, read_traffic
+    path, _ = recorded
+    events = read_traffic(path)
+    TrafficRecorder(path).close()
+    directory = os.path.dirname(path)
+    kept = [name for name in os.listdir(directory) if name != 'run.trf']
+    assert len(kept) == 1
+    assert read_traffic(os.path.join(directory, kept[0])) == events
+    assert read_traffic(path) == []
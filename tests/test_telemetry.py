@@ -0,0 +1,78 @@
+from collections import namedtuple
+import os
+
+import pytest
+
+from telemetry import MAGIC, TelemetryReader, TelemetryRecorder
+
+# Stands in for the readbacks of a PCUSnapshot
+Readback = namedtuple('Readback', ['pos', 'moving'])
+MOTORS = ['m1', 'm2']
+
+def snapshot(i):
+    return {'m1': Readback(float(i), i % 2), 'm2': Readback(-float(i), 0)}
+
+def record_n(recorder, n, start=0, state=1):
+    for i in range(start, start+n):
+        recorder.record(float(i), state, snapshot(i))
+
+def test_header_and_count(tmp_path):
+    path = str(tmp_path / 'pcu.tlm')
+    recorder = TelemetryRecorder(path, MOTORS, capacity=10, interval=0)
+    record_n(recorder, 3)
+    recorder.flush()
+    reader = TelemetryReader(path)
+    assert reader.header['magic'][0] == MAGIC
+    assert reader.motors == MOTORS
+    assert reader.capacity == 10
+    assert reader.count == 3 and len(reader) == 3
+    data = reader.to_array()
+    assert list(data['time']) == [0, 1, 2]
+    assert list(data['pos'][:, reader.column('m2')]) == [0, -1, -2]
+    assert list(data['moving'][:, reader.column('m1')]) == [0, 1, 0]
+
+def test_ring_wraparound(tmp_path):
+    path = str(tmp_path / 'pcu.tlm')
+    recorder = TelemetryRecorder(path, MOTORS, capacity=5, interval=0)
+    record_n(recorder, 12)
+    reader = TelemetryReader(path)
+    assert reader.count == 12 and len(reader) == 5
+    # Oldest first, split where the ring wrapped
+    segments = reader.segments()
+    assert [list(s['time']) for s in segments] == [[7, 8, 9], [10, 11]]
+    assert list(reader.to_array()['time']) == [7, 8, 9, 10, 11]
+
+def test_full_ring_is_one_segment(tmp_path):
+    path = str(tmp_path / 'pcu.tlm')
+    recorder = TelemetryRecorder(path, MOTORS, capacity=5, interval=0)
+    record_n(recorder, 5)
+    assert len(TelemetryReader(path).segments()) == 1
+
+def test_interval_throttle(tmp_path):
+    recorder = TelemetryRecorder(str(tmp_path / 'pcu.tlm'), MOTORS, capacity=10, interval=0.1)
+    kept = [recorder.record(t, 1, snapshot(0)) for t in [0, 0.05, 0.1, 0.15, 0.3]]
+    assert kept == [True, False, True, False, True]
+    assert recorder.count == 3
+
+def test_too_many_motors(tmp_path):
+    with pytest.raises(ValueError):
+        TelemetryRecorder(str(tmp_path / 'pcu.tlm'), [f'm{i}' for i in range(9)])
+
+def test_restart_continues_file(tmp_path):
+    path = str(tmp_path / 'pcu.tlm')
+    record_n(TelemetryRecorder(path, MOTORS, capacity=10, interval=0), 4)
+    recorder = TelemetryRecorder(path, MOTORS, capacity=10, interval=0)
+    assert recorder.count == 4
+    record_n(recorder, 2, start=4)
+    assert list(TelemetryReader(path).to_array()['time']) == [0, 1, 2, 3, 4, 5]
+    assert os.listdir(tmp_path) == ['pcu.tlm']
+
+def test_restart_keeps_incompatible_file(tmp_path):
+    path = str(tmp_path / 'pcu.tlm')
+    record_n(TelemetryRecorder(path, MOTORS, capacity=10, interval=0), 4)
+    # Different capacity: a new file, the old one is renamed
+    recorder = TelemetryRecorder(path, MOTORS, capacity=20, interval=0)
+    assert recorder.count == 0
+    kept = [name for name in os.listdir(tmp_path) if name != 'pcu.tlm']
+    assert len(kept) == 1 and kept[0].startswith('pcu-') and kept[0].endswith('.tlm')
+    assert TelemetryReader(str(tmp_path / kept[0])).count == 4
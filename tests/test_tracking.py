@@ -0,0 +1,49 @@
+import pytest
+
+from tracking import OffsetTracker
+
+FIBER = {'m1': 150, 'm2': 120, 'm3': 0, 'm4': 82.5}
+MASK = {'m1': 105, 'm2': 184, 'm3': 82.5, 'm4': 0}
+
+@pytest.mark.parametrize('element, current, target', [
+    ('fiber', FIBER, {'m1': 151, 'm2': 119}),
+    ('fiber', FIBER, {'m1': 120, 'm2': 120}),
+    ('mask', MASK, {'m1': 106, 'm2': 185}),
+])
+def test_safe_targets(geometry, element, current, target):
+    assert geometry.retarget_valid(element, current, target)
+
+@pytest.mark.parametrize('element, current, target', [
+    # Outside the circle, inside the rectangle
+    ('fiber', FIBER, {'m1': 175, 'm2': 145}),
+    # Outside the rectangle, inside the circle
+    ('fiber', FIBER, {'m1': 150, 'm2': 86 - 2}),
+    # Both ends in the hole, but the step can sweep out of it
+    ('fiber', dict(FIBER, m1=118, m2=120), {'m1': 150, 'm2': 88}),
+    # Wrong element for the configuration
+    ('mask', FIBER, {'m1': 151, 'm2': 119}),
+    ('mask', MASK, {'m1': 125, 'm2': 184}),
+])
+def test_unsafe_targets(geometry, element, current, target):
+    assert not geometry.retarget_valid(element, current, target)
+
+def test_latest_target_wins():
+    tracker = OffsetTracker({'m1': 0.01, 'm2': 0.01}, min_interval=0.1)
+    tracker.update({'m1': 1, 'm2': 1})
+    tracker.update({'m1': 2, 'm2': 2})
+    assert tracker.due(0) == {'m1': 2, 'm2': 2}
+
+def test_rate_limit():
+    tracker = OffsetTracker({'m1': 0.01, 'm2': 0.01}, min_interval=0.1)
+    tracker.update({'m1': 1, 'm2': 1})
+    tracker.sent_target(tracker.due(0), 0)
+    tracker.update({'m1': 2, 'm2': 2})
+    assert tracker.due(0.05) is None
+    assert tracker.due(0.1) == {'m1': 2, 'm2': 2}
+
+def test_repeat_within_tolerance_not_sent():
+    tracker = OffsetTracker({'m1': 0.01, 'm2': 0.01}, min_interval=0.1)
+    tracker.update({'m1': 1, 'm2': 1})
+    tracker.sent_target(tracker.due(0), 0)
+    tracker.update({'m1': 1.005, 'm2': 1})
+    assert tracker.due(1) is None